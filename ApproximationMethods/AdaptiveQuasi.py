@@ -2,42 +2,64 @@
 This method is dedicated for manifold valued functions.
 It performs the averages around the values of the functions instead of the origin.
 """
+import numpy as np
 from cachetools import cached
+from scipy.sparse import csr_matrix
 
+from ApproximationMethods.ApproximationMethod import ApproximationMethod
 from ApproximationMethods.Quasi import Quasi
-from Tools.Utils import generate_cache
+from Tools.Utils import evaluate_on_points, generate_cache, segment_ids
 from . import register_approximation_method
 
 
 @register_approximation_method("adaptive_quasi")
 class AdaptiveQuasi(Quasi):
     def __init__(self, original_function, grid_parameters, scale):
-        if isinstance(original_function, tuple):
-            original_function = combine(*original_function)
-            self._is_adaptive = True
-        else:
-            self._is_adaptive = False
-        super(AdaptiveQuasi, self).__init__(original_function, grid_parameters, scale)
+        """
+        :param original_function: The pair of functions (e_j, exp(0, e_j)).
+            The sites sample the tangents e_j, and exp(0, e_j) is evaluated
+            at the points as the bases of the averages.
+        """
+        tangent_function, self._base_function = original_function
+        super(AdaptiveQuasi, self).__init__(tangent_function, grid_parameters, scale)
 
     def _get_values_to_average(self, x, y):
         values_to_average = list()
         weights = list()
 
-        base = self._original_function(x, y)[1]
+        base = self._base_function(x, y)
         for point in self._data_sites.points_in_radius(x, y):
-            values_to_average.append(self._manifold.exp(base, point.evaluation[0]))
+            values_to_average.append(self._manifold.exp(base, point.evaluation))
             weights.append(self._get_weights_for_point(point, x, y))
 
         return values_to_average, weights
 
     @cached(cache=generate_cache(maxsize=1000))
     def approximation(self, x, y):
-        base = self._original_function(x, y)[1]
+        base = self._base_function(x, y)
         return self._manifold.log(base, super().approximation(x, y))
 
+    def approximate(self, points):
+        points = np.reshape(points, (-1, 2))
+        bases = evaluate_on_points(self._base_function, points)
+        neighbors = self._data_sites.batch_points_in_radius(points)
 
-def combine(a, b):
-    def func(x, y):
-        return a(x, y), b(x, y)
+        values_to_average = self._manifold.batch_exp(
+            bases[segment_ids(neighbors.offsets)], self._values[neighbors.indices]
+        )
+        weights = self._normalize_batch_weights(
+            self._get_batch_weights(points, neighbors), neighbors
+        )
+        # Each neighbor has its own value, so the operator acts on the neighbors.
+        operator = csr_matrix(
+            (weights, np.arange(neighbors.indices.shape[0]), neighbors.offsets),
+            shape=(points.shape[0], neighbors.indices.shape[0]),
+        )
+        averages = self._average_by_operator(operator, values_to_average)
 
-    return func
+        return self._manifold.batch_log(bases, averages)
+
+    def gradient(self, points):
+        # The bases move with the points, so the weights alone do not differentiate it.
+        # The values are tangents at the bases, so they are differenced as arrays.
+        return ApproximationMethod.gradient(self, points)
@@ -4,9 +4,9 @@ To implement it one should inherit, and implement the approximation.
 """
 from abc import abstractmethod
 import numpy as np
-from cachetools import cached
 
-from Tools.Utils import generate_cache
+# The step of the central differences of the gradient.
+GRADIENT_STEP = 10 ** -6
 
 
 class ApproximationMethod(object):
@@ -20,12 +20,33 @@ class ApproximationMethod(object):
     def approximation(self, x, y):
         pass
 
-    def _calculate_phi(self, x_0, y_0):
-        point = np.array([x_0, y_0])
+    def approximate(self, points):
+        """
+        Evaluate the approximation on many points at once.
+        This is the naive implementation, override it with a vectorized one.
+        :param points: Array of shape (N, 2).
+        :return: Array of shape (N, ...) of the approximated values.
+        """
+        return np.array(
+            [self.approximation(x, y) for x, y in np.reshape(points, (-1, 2))]
+        )
 
-        @cached(cache=generate_cache(maxsize=100))
-        def phi(x, y):
-            vector = np.array([x, y])
-            return self._kernel(vector, point)
-
-        return phi
+    def gradient(self, points):
+        """
+        The gradient of the approximation, by central differences of approximate.
+        The values are differenced as arrays, override it with an analytic gradient.
+        :param points: Array of shape (N, 2).
+        :return: Array of shape (N, 2, ...) of the derivatives by x and by y.
+        """
+        points = np.reshape(points, (-1, 2))
+        return np.stack(
+            [
+                (
+                    np.asarray(self.approximate(points + step))
+                    - np.asarray(self.approximate(points - step))
+                )
+                / (2 * GRADIENT_STEP)
+                for step in GRADIENT_STEP * np.eye(2)
+            ],
+            axis=1,
+        )
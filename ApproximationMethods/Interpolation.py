@@ -0,0 +1,92 @@
+"""
+RBF interpolation with a compactly supported kernel.
+I(f)(x) = sum c_j phi(x - x_j), where the coefficients solve the sparse system A c = f(X),
+A_ij = phi(x_i - x_j). The rbf must be positive definite on R^2, so A is positive definite.
+The interpolation is linear, so the values are real numbers or tangent vectors
+(config.IS_APPROXIMATING_ON_TANGENT).
+"""
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import splu
+
+from ApproximationMethods.Quasi import Quasi
+from Config.Config import config
+from Manifolds.RealNumbers import RealNumbers
+from RBF import POSITIVE_DEFINITE_DIMENSIONS
+from Tools.Utils import apply_operator
+from . import register_approximation_method
+
+# The dimension of the data sites.
+DIMENSION = 2
+
+
+@register_approximation_method("interpolation")
+class Interpolation(Quasi):
+    _is_kernel_convolution = False
+
+    def __init__(self, original_function, grid_parameters, scale):
+        # Check before the sites are evaluated and the kernel matrix is factorized.
+        if POSITIVE_DEFINITE_DIMENSIONS.get(config.RBF, 0) < DIMENSION:
+            raise ValueError(
+                f"The interpolation needs an rbf that is positive definite on R^{DIMENSION}, "
+                f"{config.RBF} is not"
+            )
+        if not (
+            config.IS_APPROXIMATING_ON_TANGENT or type(config.MANIFOLD) is RealNumbers
+        ):
+            raise ValueError(
+                "The interpolation is linear, set IS_APPROXIMATING_ON_TANGENT "
+                f"to interpolate values of {type(config.MANIFOLD).__name__}"
+            )
+        super().__init__(original_function, grid_parameters, scale)
+
+    def _get_site_values(self):
+        """ The coefficients of the interpolant, shape (n, ...) like the values """
+        values = super()._get_site_values()
+        coefficients = self._factorize_kernel_matrix().solve(
+            values.reshape(values.shape[0], -1)
+        )
+
+        return coefficients.reshape(values.shape)
+
+    def _factorize_kernel_matrix(self):
+        """
+        Assemble the kernel matrix from the pairs of sites in radius,
+        and factorize it with a sparse LU.
+        """
+        sites = self._data_sites.sites
+        neighbors = self._data_sites.batch_points_in_radius(sites)
+        kernel_matrix = csr_matrix(
+            (
+                self._get_batch_weights(sites, neighbors),
+                neighbors.indices,
+                neighbors.offsets,
+            ),
+            shape=(sites.shape[0], sites.shape[0]),
+        )
+
+        # The rbf is positive definite, so is the matrix. The factorization needs no
+        # pivoting, and a symmetric ordering keeps the factors sparse, like a Cholesky.
+        return splu(
+            kernel_matrix.tocsc(),
+            permc_spec="MMD_AT_PLUS_A",
+            diag_pivot_thresh=0,
+            options={"SymmetricMode": True},
+        )
+
+    @staticmethod
+    def _normalize_batch_weights(weights, neighbors):
+        return weights
+
+    @staticmethod
+    def _normalize_batch_gradients(weights, gradients, neighbors):
+        return gradients
+
+    def approximation(self, x, y):
+        return self.approximate([[x, y]])[0]
+
+    def _average_by_operator(self, operator, values):
+        # The interpolant is linear in the coefficients.
+        return apply_operator(operator, values)
+
+    def gradient(self, points):
+        return self._apply_gradient_operators(self.weight_gradient_operators(points))
@@ -1,16 +1,48 @@
 """
 This method promises polynomial reproduction, using the lambdas (of the reproduction).
 """
+import numpy as np
+
 from ApproximationMethods.Quasi import Quasi
 from . import register_approximation_method
 
 
 @register_approximation_method("moving")
 class MovingLeastSquares(Quasi):
+    _is_kernel_convolution = False
+    _is_using_lambdas = True
+
     @staticmethod
     def _get_weights_for_point(point, x, y):
-        return point.phi(x, y) * point.lambdas(x, y)
+        return point.phi * point.lambdas
+
+    def _get_batch_weights(self, points, neighbors):
+        phi = super()._get_batch_weights(points, neighbors)
+        return phi * self._data_sites.batch_lambdas(points, neighbors, phi)
+
+    def _get_batch_weight_gradients(self, points, neighbors, differences):
+        """ The product rule, the gradients of phi times the lambdas """
+        phi = super()._get_batch_weights(points, neighbors)
+        phi_gradients = super()._get_batch_weight_gradients(
+            points, neighbors, differences
+        )
+        lambdas, lambdas_gradients = self._data_sites.batch_lambdas_gradients(
+            points, neighbors, phi, phi_gradients
+        )
+
+        return (
+            phi_gradients * lambdas[:, np.newaxis]
+            + phi[:, np.newaxis] * lambdas_gradients
+        )
 
     @staticmethod
     def _normalize_weights(weights):
         return weights
+
+    @staticmethod
+    def _normalize_batch_weights(weights, neighbors):
+        return weights
+
+    @staticmethod
+    def _normalize_batch_gradients(weights, gradients, neighbors):
+        return gradients
@@ -14,6 +14,8 @@ normalization_cache = NormalizationCache(NORMALIZER_FILE)
 
 @register_approximation_method("no_normalization")
 class NoNormalization(Quasi):
+    _is_kernel_convolution = False
+
     def __init__(self, *args):
         super(NoNormalization, self).__init__(*args)
         # self._normalizer = normalization_cache[(self._rbf.__name__, self._grid_parameters[0][1].mesh_norm,
@@ -23,3 +25,13 @@ class NoNormalization(Quasi):
 
     def _normalize_weights(self, weights):
         return [w_i / self._normalizer for w_i in weights]
+
+    def _normalize_batch_weights(self, weights, neighbors):
+        return weights / self._normalizer
+
+    def _normalize_batch_gradients(self, weights, gradients, neighbors):
+        return gradients / self._normalizer
+
+    def gradient(self, points):
+        # Without normalization the approximation is linear in the values.
+        return self._apply_gradient_operators(self.weight_gradient_operators(points))
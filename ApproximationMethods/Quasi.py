@@ -2,17 +2,36 @@
 This is the main method we discuss.
 Q(f)(x) = sum f(x_i) a(x) / sum a(x).
 """
+import hashlib
+
+import numpy as np
 from cachetools import cached
+from scipy.sparse import csr_matrix
 
 from Config.Config import config
 from Config.Options import options
-from Tools.Utils import generate_kernel, generate_cache
+from Manifolds.RealNumbers import RealNumbers
+from Tools.GridConvolution import get_grid_structure, get_refinement, grid_convolution
+from Tools.Utils import (
+    apply_operator,
+    generate_cache,
+    segment_ids,
+    segment_sum,
+)
 from .ApproximationMethod import ApproximationMethod
 from . import register_approximation_method
 
+# Number of weight operators (sets of points) kept per approximation.
+OPERATORS_CACHE_SIZE = 4
+
 
 @register_approximation_method("quasi")
 class Quasi(ApproximationMethod):
+    # The weights are the rbf of the distance normalized to sum 1, a convolution on grids.
+    _is_kernel_convolution = True
+    # The weights use the polynomial reproduction coefficients of the sites.
+    _is_using_lambdas = False
+
     def __init__(
         self,
         original_function,
@@ -31,6 +50,7 @@ class Quasi(ApproximationMethod):
             grid_parameters,
             options.get_option("rbf", config.RBF),
         )
+        self._rbf_derivative = options.get_option("rbf_derivative", config.RBF)
         self._is_approximating_on_tangent = config.IS_APPROXIMATING_ON_TANGENT
         self._rbf_radius = scale
 
@@ -45,20 +65,43 @@ class Quasi(ApproximationMethod):
             self._rbf_radius,
             original_function,
             grid_parameters.fill_distance,
-            phi_generator=self._calculate_phi,
+            rbf=self._rbf,
         )
 
-        self._kernel = generate_kernel(self._rbf, self._rbf_radius)
+        self._values = self._get_site_values()
+        self._operators = generate_cache(maxsize=OPERATORS_CACHE_SIZE)
+
+    def _get_site_values(self):
+        """ The sampled values as an array of shape (n, ...) """
+        return self._data_sites.evaluation.ravel().data
 
     @staticmethod
     def _get_weights_for_point(point, x, y):
-        return point.phi(x, y)
+        return point.phi
+
+    def _get_batch_weights(self, points, neighbors):
+        return self._rbf(neighbors.distances / self._rbf_radius)
+
+    def _get_batch_weight_gradients(self, points, neighbors, differences):
+        """
+        :param differences: Array of shape (number of neighbors, 2), each point minus its neighbor.
+        :return: The gradients of the weights, array of shape (number of neighbors, 2).
+        """
+        distances = neighbors.distances
+        # The differences vanish on the sites, so any nonzero distance will do there.
+        safe_distances = np.where(distances == 0, 1, distances)
+        scales = self._rbf_derivative(distances / self._rbf_radius) / (
+            self._rbf_radius * safe_distances
+        )
+        return scales[:, np.newaxis] * differences
 
     def _get_values_to_average(self, x, y):
         values_to_average = list()
         weights = list()
 
-        for point in self._data_sites.points_in_radius(x, y):
+        for point in self._data_sites.points_in_radius(
+            x, y, is_calculating_lambdas=self._is_using_lambdas
+        ):
             values_to_average.append(point.evaluation)
             weights.append(self._get_weights_for_point(point, x, y))
 
@@ -73,6 +116,28 @@ class Quasi(ApproximationMethod):
 
         return [w_i / normalizer for w_i in weights]
 
+    @staticmethod
+    def _normalize_batch_weights(weights, neighbors):
+        normalizer = segment_sum(weights, neighbors.offsets)
+        normalizer[normalizer == 0] = 0.00001
+
+        return weights / np.repeat(normalizer, np.diff(neighbors.offsets))
+
+    @staticmethod
+    def _normalize_batch_gradients(weights, gradients, neighbors):
+        """ The quotient rule, the gradients of the normalized weights """
+        normalizer = segment_sum(weights, neighbors.offsets)
+        normalizer[normalizer == 0] = 0.00001
+        counts = np.diff(neighbors.offsets)
+        normalizer = np.repeat(normalizer, counts)[:, np.newaxis]
+        gradients_sum = np.repeat(
+            segment_sum(gradients, neighbors.offsets), counts, axis=0
+        )
+
+        return (
+            gradients - (weights[:, np.newaxis] / normalizer) * gradients_sum
+        ) / normalizer
+
     @cached(cache=generate_cache(maxsize=10000))
     def approximation(self, x, y):
         # TODO: point should be an array - not x, y. so we can generalize dimensions
@@ -85,3 +150,159 @@ class Quasi(ApproximationMethod):
             return sum(w_i * x_i for w_i, x_i in zip(weights, values_to_average))
 
         return self._manifold.average(values_to_average, weights)
+
+    def weight_operator(self, points):
+        """
+        The weights of all the sites for each of the points, as a sparse operator.
+        The weights depend only on the sites and the points,
+        so the operator is cached and reused for the same points.
+        :param points: Array of shape (N, 2).
+        :return: CSR matrix of shape (N, number of sites).
+        """
+        points = np.ascontiguousarray(np.reshape(points, (-1, 2)), dtype=np.float64)
+        key = self._get_points_key(points)
+
+        if key not in self._operators:
+            neighbors = self._data_sites.batch_points_in_radius(points)
+            weights = self._normalize_batch_weights(
+                self._get_batch_weights(points, neighbors), neighbors
+            )
+            self._operators[key] = csr_matrix(
+                (weights, neighbors.indices, neighbors.offsets),
+                shape=(points.shape[0], self._values.shape[0]),
+            )
+
+        return self._operators[key]
+
+    @staticmethod
+    def _get_points_key(points):
+        return hashlib.sha1(points.tobytes()).hexdigest()
+
+    def weight_gradient_operators(self, points):
+        """
+        The derivatives of the weight operator by x and by y.
+        :param points: Array of shape (N, 2).
+        :return: Two CSR matrices of shape (N, number of sites).
+        """
+        points = np.ascontiguousarray(np.reshape(points, (-1, 2)), dtype=np.float64)
+        key = ("gradient", self._get_points_key(points))
+
+        if key not in self._operators:
+            neighbors = self._data_sites.batch_points_in_radius(points)
+            differences = (
+                points[segment_ids(neighbors.offsets)]
+                - self._data_sites.sites[neighbors.indices]
+            )
+            gradients = self._normalize_batch_gradients(
+                self._get_batch_weights(points, neighbors),
+                self._get_batch_weight_gradients(points, neighbors, differences),
+                neighbors,
+            )
+            self._operators[key] = tuple(
+                csr_matrix(
+                    (gradients[:, axis], neighbors.indices, neighbors.offsets),
+                    shape=(points.shape[0], self._values.shape[0]),
+                )
+                for axis in range(2)
+            )
+
+        return self._operators[key]
+
+    def gradient(self, points):
+        """
+        The analytic gradient of the approximation.
+        On the tangent space it is exact. The manifold average is differentiated
+        to first order, as the weighted sum of the logs of the values around it.
+        :param points: Array of shape (N, 2).
+        :return: Array of shape (N, 2, ...) of the derivatives by x and by y.
+        """
+        operators = self.weight_gradient_operators(points)
+
+        if self._is_approximating_on_tangent:
+            return self._apply_gradient_operators(operators)
+
+        averages = self.approximate(points)
+        operator = operators[0]
+        logs = self._manifold.batch_log(
+            averages[segment_ids(operator.indptr)], self._values[operator.indices]
+        )
+        # The average normalizes the weights, the weights of MLS sum to a constant.
+        normalizer = segment_sum(self.weight_operator(points).data, operator.indptr)
+        normalizer[normalizer == 0] = 1
+        return np.stack(
+            [
+                segment_sum(
+                    operator.data.reshape((-1,) + (1,) * (logs.ndim - 1)) * logs,
+                    operator.indptr,
+                )
+                for operator in operators
+            ],
+            axis=1,
+        ) / normalizer.reshape((-1,) + (1,) * logs.ndim)
+
+    def _apply_gradient_operators(self, operators):
+        """ The gradient of a linear combination of the values """
+        return np.stack(
+            [apply_operator(operator, self._values) for operator in operators], axis=1
+        )
+
+    def approximate(self, points):
+        """ Average sampled points around each of the points, using phis as weights """
+        if self._is_linear_convolution():
+            approximation = self._approximate_by_convolution(points)
+            if approximation is not None:
+                return approximation
+
+        return self._average_by_operator(self.weight_operator(points), self._values)
+
+    def _is_linear_convolution(self):
+        """ Whether the average is the normalized weighted sum of the values """
+        return (
+            config.IS_CONVOLVING_GRIDS
+            and self._is_kernel_convolution
+            and (
+                self._is_approximating_on_tangent
+                # Subclasses of the real numbers average differently
+                or type(self._manifold) is RealNumbers
+            )
+        )
+
+    def _approximate_by_convolution(self, points):
+        """
+        When the sites are a grid and the points are a grid that refines it,
+        the approximation is a convolution of the values with the rbf,
+        divided by the convolution of the sites with the rbf.
+        :return: Array of shape (N, ...), or None if the points are not such a grid.
+        """
+        points_grid = get_grid_structure(points)
+        sites_grid = get_grid_structure(self._data_sites.sites)
+        if points_grid is None or sites_grid is None:
+            return None
+
+        refinement = get_refinement(sites_grid, points_grid)
+        if refinement is None:
+            return None
+
+        sums, weights_sums = grid_convolution(
+            self._values.reshape(sites_grid.shape + self._values.shape[1:]),
+            refinement,
+            points_grid,
+            self._rbf,
+            self._rbf_radius,
+        )
+        # Points without sites are zero, like the normalization of the operator
+        weights_sums[weights_sums == 0] = 1
+        sums /= weights_sums.reshape(weights_sums.shape + (1,) * (sums.ndim - 2))
+
+        return sums.reshape((-1,) + self._values.shape[1:])
+
+    def _average_by_operator(self, operator, values):
+        """
+        :param operator: CSR matrix of the weights, shape (N, n).
+        :param values: The values to average, shape (n, ...).
+        :return: Array of shape (N, ...) of the averages.
+        """
+        if self._is_approximating_on_tangent:
+            return apply_operator(operator, values)
+
+        return self._manifold.average_by_operator(operator, values)
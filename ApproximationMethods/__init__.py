@@ -4,7 +4,7 @@ from Config.Options import options
 register_approximation_method = options.get_type_register("approximation_method")
 
 from . import AdaptiveQuasi
+from . import Interpolation
 from . import MovingLeastSquares
-from . import Naive
 from . import NoNormalization
 from . import Quasi
@@ -2,6 +2,8 @@
 These are the default values for the configurations.
 for example config.GRID_SIZE 's default value is 0.45
 """
+import os
+import tempfile
 
 # The size of the test grid. The default grid is symmetric [-GRID_SIZE, GIRD_SIZE]^2.
 GRID_SIZE = 0.45
@@ -30,6 +32,10 @@ DATA_SITES_GENERATION = "grid"
 # Option from DataSites.Storage
 DATA_SITES_STORAGE = "kd-tree"
 
+# The full sequence of sites, array of shape (n, 2), of the "thinning" generation
+# and of the "sparse-kd-tree" storage. None if they are not used.
+SEQUENCE = None
+
 # Option from RBF
 RBF = "wendland_3_1"
 
@@ -48,6 +54,42 @@ BASE_SCALE = 1
 
 cmap = "viridis"
 
+# Keep f_j as the data of its scales and evaluate it on arrays of points,
+# instead of a chain of closures (see Experiment.multiscale_approximation)
+IS_MATERIALIZED_PIPELINE = True
+
+# The degree of the polynomials reproduced by the moving least squares
+POLYNOMIAL_DEGREE = 2
+
+# Collect the condition numbers of the polynomial reproduction problems
+IS_CALCULATING_CONDITION = False
+
+# Evaluate the quasi-interpolation of grid sites on a refined test grid as an FFT convolution.
+# The test step must divide the sites step and the sites must lie on the test grid lattice,
+# otherwise the weights are evaluated point by point.
+IS_CONVOLVING_GRIDS = True
+
+# A directory for a persistent cache of the polynomial reproduction coefficients,
+# None to disable it. Entries are .npy files keyed by the sites, points, rbf, radius and degree.
+LAMBDAS_CACHE_DIRECTORY = None
+
+# Max total size of the cache in bytes, the least recently used entries are evicted.
+LAMBDAS_CACHE_MAX_SIZE = None
+
+# A directory for the decoded pixels of the image functions, outside of the repository.
+IMAGES_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), "decoded_images")
+
+# Plot the max derivatives of each scale's approximation, from its analytic gradient
+IS_PLOTTING_SCALE_DERIVATIVES = False
+
+# The averaging of Manifolds.RigidRotations: "geodesic" (iterative L2 mean),
+# "chordal" (closed form quaternion mean) or "refined_chordal" (chordal and a geodesic step)
+ROTATIONS_AVERAGING = "geodesic"
+
+# The averaging of Manifolds.CircleAngles: "geodesic" (the same as Circle's) or
+# "circular" (the closed form angle of the weighted sum of the unit vectors)
+CIRCLE_AVERAGING = "geodesic"
+
 # The sampling addition to the test grid: [-GRID_SIZE - GRID_BORDER, GRID_SIZE + GRID_BORDER]
 GRID_BORDER = 0.5
 
@@ -1,44 +1,57 @@
 from collections import namedtuple
 
 import numpy as np
+from numpy import linalg as la
 
 from Config.Options import options
-
-
-def calculate_max_derivative(original_function, grid_params, manifold):
-    """ Calculate max directional differences in the function on the test grid """
-
-    def derivative(x, y):
-        delta = grid_params.fill_distance / 2
-        evaluations_around = [
-            original_function(x + (delta / np.sqrt(2)), y + (delta / np.sqrt(2))),
-            original_function(x, y + delta),
-            original_function(x, y - delta),
-            original_function(x + (delta / np.sqrt(2)), y - (delta / np.sqrt(2))),
-            original_function(x + delta, y),
-            original_function(x - (delta / np.sqrt(2)), y + (delta / np.sqrt(2))),
-            original_function(x - delta, y),
-            original_function(x - (delta / np.sqrt(2)), y - (delta / np.sqrt(2))),
-        ]
-        f_0 = original_function(x, y)
-
-        return max(
-            [
-                manifold.distance(direction, f_0) / delta
-                for direction in evaluations_around
-            ]
+from Tools.ManifoldArray import ManifoldArray
+from Tools.Utils import evaluate_on_points
+
+
+def _get_test_points(grid_params):
+    x, y = options.get_option("generation_method", "grid")(*grid_params)
+    return np.column_stack([x.ravel(), y.ravel()]), x.shape
+
+
+def calculate_max_derivative(
+    original_function, grid_params, manifold, center_values=None
+):
+    """
+    Calculate max directional differences in the function on the test grid.
+    The function is evaluated on the whole grid, shifted to each direction of the stencil.
+    :param center_values: The values of the function on the test grid, if already evaluated.
+    """
+    points, grid_shape = _get_test_points(grid_params)
+    delta = grid_params.fill_distance / 2
+
+    if center_values is None:
+        center_values = evaluate_on_points(original_function, points)
+    f_0 = np.reshape(center_values, (points.shape[0],) + manifold.element_shape)
+
+    angles = np.arange(8) * np.pi / 4
+    directions = delta * np.column_stack([np.cos(angles), np.sin(angles)])
+    differences = [
+        manifold.batch_distance(
+            evaluate_on_points(original_function, points + direction), f_0
         )
+        / delta
+        for direction in directions
+    ]
 
-    sites = options.get_option("generation_method", "grid")(*grid_params)
-    evaluation = options.get_option("data_storage", "grid")(
-        sites, 1, derivative, grid_params.fill_distance
-    ).evaluation
+    return np.max(differences, axis=0).reshape(grid_shape).astype(np.float32)
 
-    result = np.zeros_like(evaluation, dtype=np.float32)
-    for index in np.ndindex(result.shape):
-        result[index] = evaluation[index]
 
-    return result
+def calculate_approximation_max_derivative(approximation_method, grid_params):
+    """
+    Calculate max directional derivatives of an approximation on the test grid,
+    from its analytic gradient.
+    """
+    points, grid_shape = _get_test_points(grid_params)
+    gradients = approximation_method.gradient(points)
+
+    # The max directional derivative is the spectral norm of the jacobian.
+    jacobians = gradients.reshape(points.shape[0], 2, -1)
+    return la.norm(jacobians, ord=2, axis=(1, 2)).reshape(grid_shape).astype(np.float32)
 
 
 def evaluate_on_grid(func, grid_size, resolution, scale, points=None, should_log=False):
@@ -55,15 +68,13 @@ def evaluate_on_grid(func, grid_size, resolution, scale, points=None, should_log
             should_ravel=False,
         )
 
-    z = np.zeros(x.shape, dtype=object)
-    print("Z shape", z.shape)
-
+    z = list()
     for index in np.ndindex(x.shape):
         if index[1] == 0 and should_log:
             print("current percentage: ", index[0] / x.shape[0])
-        z[index] = func(x[index], y[index])
+        z.append(func(x[index], y[index]))
 
-    return z
+    return ManifoldArray.from_elements(z, x.shape)
 
 
 # Defining the parameters for generation and storage of data.
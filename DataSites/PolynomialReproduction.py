@@ -2,104 +2,234 @@
 Generate coefficients for the quasi-interpolation that promise polynomial reproduction.
 Based on H. Wendland's paper on local polynomial reproduction.
 """
-import os
-import pickle as pkl
-
 import numpy as np
 from numpy import linalg as la
+from scipy.sparse import csr_matrix
+
+from Config.Config import config
+from Tools.ArrayCache import ArrayCache, content_key
+from Tools.Utils import apply_operator, segment_ids
 
 condition_g = list()
 
 
+def get_polynomial_coefficients(degree):
+    """ polyval2d coefficients of the monomials x^i y^j, i + j <= degree """
+    coefficients = list()
+    for total_degree in range(degree + 1):
+        for i in range(total_degree + 1):
+            c_j = np.zeros((i + 1, total_degree - i + 1))
+            c_j[i, total_degree - i] = 1
+            coefficients.append(c_j)
+
+    return coefficients
+
+
 class PolynomialReproduction(object):
-    def __init__(self, grid, filename="cache.pkl"):
+    def __init__(self, grid, degree=None):
         self.grid = grid
 
-        # Coefficients for the linear problem. Currently for quadratic reproduction.
-        self.polynomial_coefficients = [
-            np.array([[1, 0], [0, 0]]),
-            np.array([[0, 0], [1, 0]]),
-            np.array([[0, 1], [0, 0]]),
-            # TODO: Make this configurable
-            np.array([[0, 0], [0, 1]]),
-            np.array([[0, 0, 1], [0, 0, 0]]),
-            np.array([[0, 0, 0], [0, 0, 0], [1, 0, 0]]),
-        ]
-        self._filename = filename
-
-        if os.path.exists(filename):
-            with open(filename, "rb") as f:
-                self._lambdas = pkl.load(f)
-        else:
-            self._lambdas = {}
+        if degree is None:
+            degree = config.POLYNOMIAL_DEGREE
+        self._degree = degree
 
-    def _calculate(self, x, y):
-        points_in_radius = [points for points in self.grid.points_in_radius(x, y)]
-        if len(points_in_radius) <= 3:
-            import ipdb
+        # Coefficients for the linear problem, the monomials of the reproduced polynomials.
+        self.polynomial_coefficients = get_polynomial_coefficients(degree)
+        self._lambdas = {}
 
-            ipdb.set_trace()
-        polynomials_in_radius = np.array(
-            [
-                [
-                    np.polynomial.polynomial.polyval2d(x_i.x, x_i.y, c_j)
-                    for c_j in self.polynomial_coefficients
-                ]
-                for x_i in points_in_radius
-            ]
-        )
+        # The coefficients of whole batches are kept on disk, see config.LAMBDAS_CACHE_DIRECTORY
+        self._batches_cache = None
+        if config.LAMBDAS_CACHE_DIRECTORY is not None:
+            self._batches_cache = ArrayCache(
+                config.LAMBDAS_CACHE_DIRECTORY, config.LAMBDAS_CACHE_MAX_SIZE
+            )
 
-        kernel = np.diag([x_i.phi(x, y) for x_i in points_in_radius])
+    def _calculate(self, x, y):
+        point = np.array([[x, y]])
+        neighbors = self.grid.batch_points_in_radius(point)
+        sites_in_radius = self.grid.sites[neighbors.indices]
+
+        return self._solve(
+            point,
+            self._polynomials(sites_in_radius[:, 0], sites_in_radius[:, 1]),
+            self.grid.batch_phi(neighbors),
+            neighbors.offsets,
+        )[0, :, np.newaxis]
+
+    def _solve(self, points, polynomials_at_sites, kernel_weights, offsets):
+        """
+        Solve the linear problems of polynomial reproduction of many points at once.
+        :param points: Array of shape (N, 2).
+        :param polynomials_at_sites: The polynomials at the neighbors of the points,
+            array of shape (number of neighbors, number of polynomials).
+        :param kernel_weights: The kernel of each neighbor, array of shape (number of neighbors,).
+        :param offsets: The neighbors of the i-th point are [offsets[i]:offsets[i + 1]].
+        :return: The coefficients of the polynomials, array of shape (N, number of polynomials).
+        """
+        to_inv = self._gram_matrices(polynomials_at_sites, kernel_weights, offsets)
+        polynomials_at_points = self._polynomials(points[:, 0], points[:, 1])
+
+        if config.IS_CALCULATING_CONDITION:
+            # The Gram matrices are symmetric, so the condition is a ratio of eigenvalues.
+            eigenvalues = np.abs(la.eigvalsh(to_inv))
+            condition_g.extend(eigenvalues[:, -1] / eigenvalues[:, 0])
+
+        # Solve the linear problem of polynomial reproduction
+        return (
+            2
+            * self._solve_gram(to_inv, polynomials_at_points[:, :, np.newaxis])[..., 0]
+        )
 
-        polynomials_at_point = np.array(
-            [
-                [np.polynomial.polynomial.polyval2d(x, y, c_j)]
-                for c_j in self.polynomial_coefficients
-            ]
+    @staticmethod
+    def _gram_matrices(polynomials_at_sites, kernel_weights, offsets):
+        """
+        The weighted Gram matrices P^T K P, summed over the neighbors of each point.
+        :return: Array of shape (N, number of polynomials, number of polynomials).
+        """
+        operator = csr_matrix(
+            (kernel_weights, np.arange(kernel_weights.shape[0]), offsets),
+            shape=(offsets.shape[0] - 1, kernel_weights.shape[0]),
+        )
+        return apply_operator(
+            operator,
+            polynomials_at_sites[:, :, np.newaxis]
+            * polynomials_at_sites[:, np.newaxis, :],
         )
 
+    @staticmethod
+    def _solve_gram(gram_matrices, right_hand_sides):
+        """ Solve the Gram systems, the pseudo inverse is used when one is singular """
         try:
-            # Solve the linear problem of polynomial reproduction
-            to_inv = np.matmul(
-                np.matmul(np.transpose(polynomials_in_radius), kernel),
-                polynomials_in_radius,
-            )
-
-            # This is the condition number of the problem
-            cond = la.cond(to_inv)
-            print(f"Condition {cond}")
-            condition_g.append(cond)
-            return 2 * np.matmul(la.inv(to_inv), polynomials_at_point)
-        except la.LinAlgError as e:
+            return la.solve(gram_matrices, right_hand_sides)
+        except la.LinAlgError:
             print(f"Singular")
-            return np.matmul(to_inv, polynomials_at_point)
+            return np.matmul(la.pinv(gram_matrices), right_hand_sides)
 
     def calculate(self, x, y):
         value = self._lambdas.get((x, y), None)
         if value is None:
-            print(f"calculating {x}, {y}")
             value = self._calculate(x, y)
             self._lambdas[(x, y)] = value
 
         return value
 
-    def update(self):
-        with open(self._filename, "wb") as f:
-            pkl.dump(self._lambdas, f, protocol=pkl.HIGHEST_PROTOCOL)
-
-    def weight_for_grid(self, x_j, y_j):
-        """ Get a(x, y) coefficient for the quasi-interpolation {sum a(p)f(p_i)} """
+    def _polynomials(self, x, y):
+        """ Evaluate the reproduced polynomials, shape (..., number of polynomials) """
+        return np.stack(
+            [
+                np.polynomial.polynomial.polyval2d(x, y, c_j)
+                for c_j in self.polynomial_coefficients
+            ],
+            axis=-1,
+        )
 
-        def weight(x, y):
-            # TODO: Debug! why did i need to transpose?
-            return np.inner(
-                np.transpose(self.calculate(x, y)),
-                np.array(
+    def _polynomial_gradients(self, x, y):
+        """ The gradients of the reproduced polynomials, shape (..., number of polynomials, 2) """
+        return np.stack(
+            [
+                np.stack(
                     [
-                        np.polynomial.polynomial.polyval2d(x_j, y_j, c_j)
-                        for c_j in self.polynomial_coefficients
-                    ]
-                ),
+                        np.polynomial.polynomial.polyval2d(
+                            x, y, np.polynomial.polynomial.polyder(c_j, axis=axis)
+                        )
+                        for axis in range(2)
+                    ],
+                    axis=-1,
+                )
+                for c_j in self.polynomial_coefficients
+            ],
+            axis=-2,
+        )
+
+    def batch_weights(self, points, neighbors, sites, kernel_weights):
+        """
+        Get the a(x) coefficients of all the neighbors of many points.
+        :param points: Array of shape (N, 2).
+        :param neighbors: The Neighbors of the points.
+        :param sites: The data sites, array of shape (n, 2).
+        :param kernel_weights: The kernel of each neighbor, in the layout of neighbors.indices.
+        :return: Array of the coefficients, in the layout of neighbors.indices.
+        """
+        points = np.reshape(points, (-1, 2))
+        polynomials_at_sites = self._polynomials(
+            sites[neighbors.indices, 0], sites[neighbors.indices, 1]
+        )
+        coefficients = self._get_batch_coefficients(
+            points, sites, polynomials_at_sites, kernel_weights, neighbors.offsets
+        )
+
+        return np.sum(
+            polynomials_at_sites * coefficients[segment_ids(neighbors.offsets)], axis=1
+        )
+
+    def batch_weight_gradients(
+        self, points, neighbors, sites, kernel_weights, kernel_gradients
+    ):
+        """
+        Get the a(x) coefficients of all the neighbors of many points, and their gradients.
+        The solution c(x) of G(x) c(x) = 2 p(x) is differentiated as
+        G(x) dc(x) = 2 dp(x) - dG(x) c(x), where dG(x) is the Gram matrix of the kernel gradients.
+        :param kernel_gradients: The gradients of the kernel of each neighbor,
+            array of shape (number of neighbors, 2).
+        :return: Array of the coefficients, in the layout of neighbors.indices,
+            and array of their gradients, shape (number of neighbors, 2).
+        """
+        points = np.reshape(points, (-1, 2))
+        polynomials_at_sites = self._polynomials(
+            sites[neighbors.indices, 0], sites[neighbors.indices, 1]
+        )
+        gram_matrices = self._gram_matrices(
+            polynomials_at_sites, kernel_weights, neighbors.offsets
+        )
+        coefficients = 2 * self._solve_gram(
+            gram_matrices,
+            self._polynomials(points[:, 0], points[:, 1])[:, :, np.newaxis],
+        )
+        polynomial_gradients = self._polynomial_gradients(points[:, 0], points[:, 1])
+        right_hand_sides = np.concatenate(
+            [
+                2 * polynomial_gradients[:, :, [axis]]
+                - np.matmul(
+                    self._gram_matrices(
+                        polynomials_at_sites,
+                        kernel_gradients[:, axis],
+                        neighbors.offsets,
+                    ),
+                    coefficients,
+                )
+                for axis in range(2)
+            ],
+            axis=2,
+        )
+        coefficients_gradients = self._solve_gram(gram_matrices, right_hand_sides)
+
+        rows = segment_ids(neighbors.offsets)
+        return (
+            np.sum(polynomials_at_sites * coefficients[rows, :, 0], axis=1),
+            np.einsum("ij,ijk->ik", polynomials_at_sites, coefficients_gradients[rows]),
+        )
+
+    def _get_batch_coefficients(
+        self, points, sites, polynomials_at_sites, kernel_weights, offsets
+    ):
+        """ _solve, through the cache of batches when it is enabled """
+        if self._batches_cache is None:
+            return self._solve(points, polynomials_at_sites, kernel_weights, offsets)
+
+        # The problems are determined by the sites, the points, the kernel and the degree.
+        key = content_key(
+            "lambdas",
+            np.asarray(sites, dtype=np.float64),
+            np.asarray(points, dtype=np.float64),
+            config.RBF,
+            self.grid.rbf_radius,
+            self._degree,
+        )
+        coefficients = self._batches_cache.get(key)
+        if coefficients is None:
+            coefficients = self._solve(
+                points, polynomials_at_sites, kernel_weights, offsets
             )
+            self._batches_cache[key] = coefficients
 
-        return weight
+        return coefficients
@@ -0,0 +1,99 @@
+"""
+This method buckets the sites in square cells of the size of the rbf radius.
+All the sites in radius of a point are in the 3x3 cells around its cell.
+"""
+import numpy as np
+
+from DataSites.PolynomialReproduction import PolynomialReproduction
+from DataSites.Storage import add_sampling_class
+from DataSites.Storage.Storage import (
+    DataSitesStorage,
+    Neighbors,
+    evaluate_function,
+    get_rbf,
+)
+
+# The cells around a cell, including itself
+CELL_OFFSETS = np.array([[i, j] for i in (-1, 0, 1) for j in (-1, 0, 1)])
+
+
+@add_sampling_class("cell-list")
+class CellList(DataSitesStorage):
+    def __init__(self, sites, rbf_radius, function_to_evaluate, *_, rbf=None):
+
+        # Grid compatability
+        if type(sites) is tuple:
+            points_in_matrices = [axis.ravel() for axis in sites]
+            sites = np.transpose(np.array(points_in_matrices))
+
+        self._rbf_radius = rbf_radius
+        self._rbf = get_rbf(rbf)
+        self._seq = sites
+        self._build_cells()
+        self._evaluation = self._evaluate_on_grid(function_to_evaluate)
+
+        self._lambdas_generator = PolynomialReproduction(self)
+
+    def _cells_of(self, points):
+        """ The (column, row) cell coordinates of points """
+        return np.floor((points - self._origin) / self._rbf_radius).astype(np.int64)
+
+    def _build_cells(self):
+        """
+        Sort the sites by their cell id.
+        The sites of the cell c are self._sorted_sites[self._cell_offsets[c]:self._cell_offsets[c + 1]].
+        """
+        self._origin = np.min(self._seq, axis=0)
+        cells = self._cells_of(self._seq)
+        self._number_of_cells = np.max(cells, axis=0) + 1
+
+        cell_ids = cells[:, 0] * self._number_of_cells[1] + cells[:, 1]
+        self._sorted_sites = np.argsort(cell_ids, kind="stable")
+        self._cell_offsets = np.searchsorted(
+            cell_ids[self._sorted_sites],
+            np.arange(np.prod(self._number_of_cells) + 1),
+        )
+
+    def batch_points_in_radius(self, points):
+        points = np.reshape(points, (-1, 2))
+
+        # The 3x3 cells around the cell of each point, shape (N, 9, 2)
+        cells = self._cells_of(points)[:, np.newaxis] + CELL_OFFSETS
+        is_cell = np.all((cells >= 0) & (cells < self._number_of_cells), axis=-1)
+        cell_ids = np.where(
+            is_cell, cells[..., 0] * self._number_of_cells[1] + cells[..., 1], 0
+        )
+        starts = self._cell_offsets[cell_ids]
+        counts = np.where(is_cell, self._cell_offsets[cell_ids + 1] - starts, 0)
+
+        # Flatten the sites of all the cells, grouped by point
+        counts = counts.ravel()
+        candidates_offsets = np.cumsum(counts) - counts
+        positions = np.arange(np.sum(counts)) + np.repeat(
+            starts.ravel() - candidates_offsets, counts
+        )
+        candidates = self._sorted_sites[positions]
+        rows = np.repeat(np.arange(points.shape[0]), np.sum(counts.reshape(-1, 9), 1))
+
+        distances = np.hypot(
+            self._seq[candidates, 0] - points[rows, 0],
+            self._seq[candidates, 1] - points[rows, 1],
+        )
+        is_neighbor = distances < self._rbf_radius
+
+        offsets = np.zeros(points.shape[0] + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(rows[is_neighbor], minlength=points.shape[0]), out=offsets[1:]
+        )
+        return Neighbors(offsets, candidates[is_neighbor], distances[is_neighbor])
+
+    @property
+    def sites(self):
+        return self._seq
+
+    @property
+    def evaluation(self):
+        return self._evaluation
+
+    def _evaluate_on_grid(self, function_to_evaluate):
+        return evaluate_function(function_to_evaluate, self._seq[:, 0], self._seq[:, 1])
@@ -6,7 +6,17 @@ import numpy as np
 
 from DataSites.PolynomialReproduction import PolynomialReproduction
 from . import add_sampling_class
-from DataSites.Storage.Storage import DataSitesStorage, Point
+from DataSites.Storage.Storage import (
+    DataSitesStorage,
+    Neighbors,
+    compress_neighbors,
+    evaluate_function,
+    get_rbf,
+)
+from Tools.Utils import segment_positions, segment_sum
+
+# Points are in the same stencil if their offsets from the grid agree up to this fraction of a step.
+STENCIL_RESOLUTION = 10 ** -9
 
 
 @add_sampling_class("grid")
@@ -18,61 +28,174 @@ class Grid(DataSitesStorage):
         rbf_radius,
         function_to_evaluate,
         fill_distance,
-        phi_generator=None,
+        rbf=None,
     ):
         self._x, self._y = sites
         self._x_min = np.min(self._x)
         self._y_min = np.min(self._y)
         self._evaluation = self._evaluate_on_grid(function_to_evaluate)
-        self._phi = None
         self._fill_distance = fill_distance
 
-        if phi_generator is not None:
-            self._phi = self._evaluate_on_grid(phi_generator)
-
-        self._radius_in_index = int(np.ceil(rbf_radius / self._fill_distance))
+        self._rbf_radius = rbf_radius
+        self._rbf = get_rbf(rbf)
+        self._sites = np.column_stack([self._x.ravel(), self._y.ravel()])
+        # The actual spacing of the grid, which can be a bit off the fill distance
+        self._x_step = self._get_step(self._x[0, :])
+        self._y_step = self._get_step(self._y[:, 0])
 
-        self._lambdas_generator = PolynomialReproduction(self, "grid_cache.pkl")
-        self._lambdas = self._evaluate_on_grid(self._lambdas_generator.weight_for_grid)
+        self._lambdas_generator = PolynomialReproduction(self)
 
     def _evaluate_on_grid(self, func):
-        evaluation = np.zeros_like(self._x, dtype=object)
-
-        for index in np.ndindex(self._x.shape):
-            if index[1] == 0:
-                print(index[0] / self._x.shape[0])
-            evaluation[index] = func(self._x[index], self._y[index])
-
-        return evaluation
-
-    def points_in_radius(self, x, y):
-        # Warning! There might be a bug, and I should want to replace x, and y.
-        x_0 = int((x - self._x_min) / self._fill_distance)
-        y_0 = int((y - self._y_min) / self._fill_distance)
-        index_0 = np.array([y_0, x_0])
-        radius_array = np.array([self._radius_in_index + 1, self._radius_in_index + 1])
-
-        for index in np.ndindex(
-            2 * self._radius_in_index + 2, 2 * self._radius_in_index + 2
-        ):
-            current_index = tuple(index_0 - radius_array + np.array(index))
-            if all(
-                [
-                    current_index[0] >= 0,
-                    current_index[1] >= 0,
-                    current_index[0] < self._x.shape[0],
-                    current_index[1] < self._y.shape[1],
-                ]
-            ):
-                # This is important to avoid singular matrices.
-                if self._phi[current_index](x, y) != 0:
-                    yield Point(
-                        self._evaluation[current_index],
-                        self._phi[current_index],
-                        self._x[current_index],
-                        self._y[current_index],
-                        self._lambdas[current_index],
-                    )
+        return evaluate_function(func, self._x, self._y)
+
+    def _get_step(self, axis):
+        if axis.shape[0] < 2:
+            return self._fill_distance
+        return (axis[-1] - axis[0]) / (axis.shape[0] - 1)
+
+    def batch_points_in_radius(self, points):
+        """
+        Find the neighbors by index arithmetic: the candidates of each point are
+        the block of grid indices around it, which contains the whole radius.
+        The neighbors are indices of the raveled grid, in the order of the grid.
+        """
+        points = np.reshape(points, (-1, 2))
+        rows, columns = self._x.shape
+        radius_in_rows, radius_in_columns = self._radius_in_steps()
+        row_0, column_0 = self._grid_positions(points)[0]
+
+        row_offsets, column_offsets = np.meshgrid(
+            np.arange(-radius_in_rows, radius_in_rows + 2),
+            np.arange(-radius_in_columns, radius_in_columns + 2),
+            indexing="ij",
+        )
+        candidate_rows = row_0[:, np.newaxis] + row_offsets.ravel()
+        candidate_columns = column_0[:, np.newaxis] + column_offsets.ravel()
+
+        is_in_grid = (
+            (candidate_rows >= 0)
+            & (candidate_rows < rows)
+            & (candidate_columns >= 0)
+            & (candidate_columns < columns)
+        )
+        candidates = np.where(
+            is_in_grid, candidate_rows * columns + candidate_columns, 0
+        )
+        distances = np.hypot(
+            self._sites[candidates, 0] - points[:, 0, np.newaxis],
+            self._sites[candidates, 1] - points[:, 1, np.newaxis],
+        )
+
+        # Only sites with nonzero phi, this is important to avoid singular matrices.
+        return compress_neighbors(
+            candidates, distances, is_in_grid & (distances < self._rbf_radius)
+        )
+
+    def _radius_in_steps(self):
+        return (
+            int(np.ceil(self._rbf_radius / self._y_step)),
+            int(np.ceil(self._rbf_radius / self._x_step)),
+        )
+
+    def _grid_positions(self, points):
+        """
+        :return: The (row, column) of the grid cell of each point, and the
+            offsets of the points from it in fractions of a step.
+        """
+        positions = np.column_stack(
+            [
+                (points[:, 1] - self._y_min) / self._y_step,
+                (points[:, 0] - self._x_min) / self._x_step,
+            ]
+        )
+        cells = np.floor(positions)
+        return cells.astype(np.int64).T, positions - cells
+
+    def batch_lambdas(self, points, neighbors, kernel_weights):
+        """
+        Away from the borders the sites around a point are the same up to a
+        translation for all the points with the same offset from the grid,
+        so their polynomial reproduction problems have the same solution.
+        Solve a single problem for every offset, and the border points on their own.
+        """
+        points = np.reshape(points, (-1, 2))
+        radius_in_rows, radius_in_columns = self._radius_in_steps()
+        (row_0, column_0), offsets_in_steps = self._grid_positions(points)
+
+        # The whole block of candidates of batch_points_in_radius is in the grid
+        is_interior = (
+            (row_0 - radius_in_rows >= 0)
+            & (row_0 + radius_in_rows + 1 < self._x.shape[0])
+            & (column_0 - radius_in_columns >= 0)
+            & (column_0 + radius_in_columns + 1 < self._x.shape[1])
+        )
+        interior = np.flatnonzero(is_interior)
+        _, representatives, stencils = np.unique(
+            np.round(offsets_in_steps[interior] / STENCIL_RESOLUTION),
+            axis=0,
+            return_index=True,
+            return_inverse=True,
+        )
+        stencils = stencils.ravel()
+
+        sources = interior[representatives][stencils]
+
+        # Points on the edge of the radius can still differ in their neighbors.
+        is_same_stencil = self._is_same_neighborhood(
+            neighbors, row_0 * self._x.shape[1] + column_0, interior, sources
+        )
+        solved = np.union1d(np.flatnonzero(~is_interior), interior[~is_same_stencil])
+        solved = np.union1d(solved, interior[representatives])
+
+        lambdas = np.zeros(neighbors.indices.shape[0])
+        solved_offsets, solved_positions = segment_positions(neighbors.offsets, solved)
+        lambdas[solved_positions] = super(Grid, self).batch_lambdas(
+            points[solved],
+            Neighbors(
+                solved_offsets,
+                neighbors.indices[solved_positions],
+                neighbors.distances[solved_positions],
+            ),
+            kernel_weights[solved_positions],
+        )
+
+        # Copy the solutions of the representatives to the rest of their stencils
+        _, source_positions = segment_positions(
+            neighbors.offsets, sources[is_same_stencil]
+        )
+        _, target_positions = segment_positions(
+            neighbors.offsets, interior[is_same_stencil]
+        )
+        lambdas[target_positions] = lambdas[source_positions]
+
+        return lambdas
+
+    @staticmethod
+    def _is_same_neighborhood(neighbors, cells, points, others):
+        """
+        Whether the neighbors of each point are the neighbors of the other point,
+        translated by the difference of their grid cells.
+        :param cells: The raveled grid index of the cell of every point.
+        """
+        counts = np.diff(neighbors.offsets)
+        is_same = counts[points] == counts[others]
+
+        offsets, positions = segment_positions(neighbors.offsets, points[is_same])
+        _, other_positions = segment_positions(neighbors.offsets, others[is_same])
+        relative_sites = neighbors.indices - np.repeat(cells, counts)
+        mismatches = segment_sum(
+            (relative_sites[positions] != relative_sites[other_positions]).astype(
+                np.int64
+            ),
+            offsets,
+        )
+        is_same[is_same] = mismatches == 0
+
+        return is_same
+
+    @property
+    def sites(self):
+        return self._sites
 
     @property
     def evaluation(self):
@@ -85,6 +208,3 @@ class Grid(DataSitesStorage):
     @property
     def y(self):
         return self._y
-
-    def close(self):
-        self._lambdas_generator.update()
@@ -4,29 +4,133 @@ from pykdtree.kdtree import KDTree
 from DataSites.Storage import add_sampling_class
 from DataSites.Storage.KDTree import KDTreeSampler
 from Config.Config import config
-from DataSites.Storage.Storage import Point
+from Tools.ManifoldArray import ManifoldArray
+from Tools.Utils import segment_sum
+from DataSites.Storage.Storage import (
+    Neighbors,
+    evaluate_function,
+    merge_neighbors,
+)
+
+# Number of the closest points of the full sequence added to every neighborhood.
+NUMBER_OF_EXTRA_POINTS = 3
 
 
 @add_sampling_class("sparse-kd-tree")
 class SparseKDTree(KDTreeSampler):
-    def __init__(self, sites, rbf_radius, function_to_evaluate, *_, phi_generator=None):
+    def __init__(
+        self,
+        sites,
+        rbf_radius,
+        function_to_evaluate,
+        *_,
+        rbf=None,
+        full_sequence=None,
+    ):
+        """
+        :param full_sequence: Array of shape (n, 2) of the sites the extra points
+            are taken from, config.SEQUENCE by default.
+        """
         super(SparseKDTree, self).__init__(
-            sites, rbf_radius, function_to_evaluate, _, phi_generator=phi_generator
+            sites, rbf_radius, function_to_evaluate, _, rbf=rbf
         )
-        self._full_sequence = config.SEQUENCE
+        if full_sequence is None:
+            full_sequence = config.SEQUENCE
+        if full_sequence is None:
+            raise ValueError(
+                "The sparse kd-tree needs a full sequence, set config.SEQUENCE"
+            )
+        self._full_sequence = np.ascontiguousarray(full_sequence, dtype=np.float64)
         self._full_kd_tree = KDTree(self._full_sequence)
         self._function_to_evaluate = function_to_evaluate
 
-    def points_in_radius(self, x, y):
-        counter = 0
-        for p in super(SparseKDTree, self).points_in_radius(x, y):
-            yield p
-
-        if counter < 2:
-            _, idx = self._full_kd_tree.query(np.array([[x, y]]), k=3)
-            for index in idx[0]:
-                x = self._full_sequence[index, 0]
-                y = self._full_sequence[index, 1]
-                phi = self._phi_generator(x, y)
-                func = self._function_to_evaluate(x, y)
-                yield Point(func, phi, x, y, 0)
+        # The sites of the full sequence follow the sites of the tree.
+        # They are evaluated when they are first merged into a neighborhood.
+        self._evaluation = ManifoldArray.concatenate(
+            [
+                self._evaluation,
+                ManifoldArray(
+                    np.zeros(
+                        (self._full_sequence.shape[0],) + self._evaluation.element_shape
+                    ),
+                    self._evaluation.element_shape,
+                ),
+            ]
+        )
+        self._is_evaluated = np.zeros(self._full_sequence.shape[0], dtype=bool)
+
+    def __getstate__(self):
+        state = super(SparseKDTree, self).__getstate__()
+        del state["_full_kd_tree"]
+        return state
+
+    def __setstate__(self, state):
+        super(SparseKDTree, self).__setstate__(state)
+        self._full_kd_tree = KDTree(self._full_sequence)
+
+    def batch_points_in_radius(self, points):
+        points = np.ascontiguousarray(np.reshape(points, (-1, 2)), dtype=np.float64)
+        distances, ids = self._full_kd_tree.query(points, k=NUMBER_OF_EXTRA_POINTS)
+        ids = ids.reshape(points.shape[0], -1).astype(np.int64)
+        self._evaluate_full_sequence(ids)
+
+        extra_neighbors = Neighbors(
+            np.arange(points.shape[0] + 1, dtype=np.int64) * ids.shape[1],
+            self._seq.shape[0] + ids.ravel(),
+            distances.ravel(),
+        )
+        return merge_neighbors(
+            super(SparseKDTree, self).batch_points_in_radius(points), extra_neighbors
+        )
+
+    def _evaluate_full_sequence(self, ids):
+        """ Evaluate the points of the full sequence that were not evaluated yet """
+        ids = np.unique(ids)
+        ids = ids[~self._is_evaluated[ids]]
+        if ids.shape[0] == 0:
+            return
+
+        # In place, so the values taken from evaluation see the new points.
+        self._evaluation[self._seq.shape[0] + ids] = evaluate_function(
+            self._function_to_evaluate,
+            self._full_sequence[ids, 0],
+            self._full_sequence[ids, 1],
+        )
+        self._is_evaluated[ids] = True
+
+    def batch_lambdas(self, points, neighbors, kernel_weights):
+        # The extra points have no polynomial reproduction coefficients.
+        is_site, sites_neighbors = self._sites_neighbors(neighbors)
+        lambdas = np.zeros(neighbors.indices.shape[0])
+        lambdas[is_site] = super(SparseKDTree, self).batch_lambdas(
+            points, sites_neighbors, kernel_weights[is_site]
+        )
+        return lambdas
+
+    def batch_lambdas_gradients(
+        self, points, neighbors, kernel_weights, kernel_gradients
+    ):
+        is_site, sites_neighbors = self._sites_neighbors(neighbors)
+        lambdas = np.zeros(neighbors.indices.shape[0])
+        gradients = np.zeros((neighbors.indices.shape[0], 2))
+        lambdas[is_site], gradients[is_site] = super(
+            SparseKDTree, self
+        ).batch_lambdas_gradients(
+            points, sites_neighbors, kernel_weights[is_site], kernel_gradients[is_site]
+        )
+        return lambdas, gradients
+
+    def _sites_neighbors(self, neighbors):
+        """ The neighbors that are sites of the tree, without the extra points """
+        is_site = neighbors.indices < self._seq.shape[0]
+        offsets = np.zeros_like(neighbors.offsets)
+        np.cumsum(
+            segment_sum(is_site.astype(np.int64), neighbors.offsets), out=offsets[1:]
+        )
+        return is_site, Neighbors(
+            offsets, neighbors.indices[is_site], neighbors.distances[is_site]
+        )
+
+    @property
+    def sites(self):
+        return np.concatenate([self._seq, self._full_sequence])
@@ -2,71 +2,247 @@ from abc import abstractmethod
 from collections import namedtuple
 
 import numpy as np
-from cachetools import cached
 
+from Config.Config import config
+from Config.Options import options
 from DataSites.Generation.Combination import SamplingPointsCollection
 from DataSites.GridUtils import GridParameters
 from DataSites.PolynomialReproduction import PolynomialReproduction
-from Tools.Utils import generate_cache, generate_kernel
+from Tools.ManifoldArray import ManifoldArray
+from Tools.Utils import evaluate_on_points, is_evaluated_on_arrays
 from RBF import wendland_3_1
 
 Point = namedtuple("Point", ["evaluation", "phi", "x", "y", "lambdas"])
 
+# Neighbors of many query points in a flat (CSR) layout.
+# The neighbors of the i-th point are indices[offsets[i]:offsets[i + 1]].
+Neighbors = namedtuple("Neighbors", ["offsets", "indices", "distances"])
+
+# The first number of neighbors of a tree query, it grows until the query is complete.
+INITIAL_NEIGHBORS = 30
+
 
 class DataSitesStorage(object):
     # TODO: do this
 
-    def __init__(self, sites, rbf_radius, function_to_evaluate, *args, **kwargs):
+    def __init__(
+        self, sites, rbf_radius, function_to_evaluate, *args, rbf=None, **kwargs
+    ):
         """
         Data Structure that gives the points in radius when asked.
+        The storages keep arrays only: the sites, their values and the kernel parameters.
+        The kernel of the sites is calculated when the sites are queried.
         :param sites: List of sites (columns x,y)
         :param rbf_radius: For the points_in_radius query
         :param function_to_evaluate:
         :param args:
+        :param rbf: The radial function of the kernel, config.RBF by default.
         :param kwargs:
         """
         # TODO: remove rbf_radius
-        # TODO: change to "functions to evaluate" (and now no need to phi_generator).
+        # TODO: change to "functions to evaluate".
         # TODO: maybe function_to_evaluate can be in a setter.
         # TODO: add to grid_parameters the method of creation
         self._rbf_radius = rbf_radius
+        self._rbf = get_rbf(rbf)
         self._function_to_evaluate = function_to_evaluate
 
-    @abstractmethod
-    def points_in_radius(self, x, y):
+    def points_in_radius(self, x, y, is_calculating_lambdas=False):
+        """
+        The sites in radius of (x, y), with their kernel at (x, y).
+        :param is_calculating_lambdas: Calculate the polynomial reproduction coefficients,
+            otherwise the lambdas of the points are None.
+        """
         # TODO: change to (point, radius)
+        point = np.array([[x, y]])
+        neighbors = self.batch_points_in_radius(point)
+        phi = self.batch_phi(neighbors)
+        lambdas = [None] * len(neighbors.indices)
+        if is_calculating_lambdas:
+            lambdas = self.batch_lambdas(point, neighbors, phi)
+
+        sites = self.sites
+        evaluation = self.evaluation.ravel()
+        for index, phi_i, lambdas_i in zip(neighbors.indices, phi, lambdas):
+            yield Point(
+                evaluation[index], phi_i, sites[index, 0], sites[index, 1], lambdas_i
+            )
+
+    @abstractmethod
+    def batch_points_in_radius(self, points):
+        """
+        Query the sites in radius of many points at once.
+        :param points: Array of shape (N, 2).
+        :return: Neighbors of the points.
+        """
         pass
 
+    @property
+    def rbf_radius(self):
+        return self._rbf_radius
 
-# TODO: A multiscale class that aggregates points. (add_points method)
+    @property
+    @abstractmethod
+    def sites(self):
+        """ The data sites as an array of shape (n, 2) """
+        pass
 
+    def batch_phi(self, neighbors):
+        """ The kernel of each neighbor, in the layout of neighbors.indices """
+        return self._rbf(neighbors.distances / self._rbf_radius)
 
-def unittest():
-    def _calculate_phi(x_0, y_0):
-        point = np.array([x_0, y_0])
-        rbf_radius = 0.5
+    def batch_lambdas(self, points, neighbors, kernel_weights):
+        """
+        The polynomial reproduction coefficients of the neighbors of the points.
+        :param kernel_weights: The kernel of each neighbor, in the layout of neighbors.indices.
+        """
+        return self._lambdas_generator.batch_weights(
+            points, neighbors, self.sites, kernel_weights
+        )
 
-        @cached(cache=generate_cache(maxsize=100))
-        def phi(x, y):
-            vector = np.array([x, y])
-            kernel = generate_kernel(wendland_3_1, rbf_radius)
-            return kernel(vector, point)
+    def batch_lambdas_gradients(
+        self, points, neighbors, kernel_weights, kernel_gradients
+    ):
+        """
+        The polynomial reproduction coefficients of the neighbors, and their gradients.
+        :param kernel_weights: The kernel of each neighbor, in the layout of neighbors.indices.
+        :param kernel_gradients: The gradients of the kernel of each neighbor,
+            array of shape (number of neighbors, 2).
+        :return: The coefficients, and their gradients of shape (number of neighbors, 2).
+        """
+        return self._lambdas_generator.batch_weight_gradients(
+            points, neighbors, self.sites, kernel_weights, kernel_gradients
+        )
+
+
+def get_rbf(rbf=None):
+    """ The radial function of the kernel of the storages, config.RBF by default """
+    if rbf is None:
+        return options.get_option("rbf", config.RBF)
+
+    return rbf
+
+
+def query_tree(tree, points, radius, number_of_sites, k=INITIAL_NEIGHBORS):
+    """
+    Query a kd-tree for all the sites in radius of all the points at once.
+    Points whose k nearest sites are all in radius are queried again with
+    a doubled k, until their neighborhoods are complete.
+    :param tree: KDTree of the sites.
+    :param points: Array of shape (N, 2).
+    :param radius: Neighbors are strictly closer than radius.
+    :param number_of_sites: The size of the tree, marks missing neighbors.
+    :param k: The first number of neighbors per point.
+    :return: Neighbors of the points.
+    """
+    points = np.ascontiguousarray(np.reshape(points, (-1, 2)), dtype=np.float64)
+    k = min(k, number_of_sites)
+    queries = list()
+    remaining = np.arange(points.shape[0])
+
+    while remaining.shape[0] > 0:
+        distances, ids = tree.query(points[remaining], k=k, distance_upper_bound=radius)
+        distances = distances.reshape(-1, k)
+        ids = ids.reshape(-1, k)
+
+        is_complete = (ids[:, -1] == number_of_sites) | (k == number_of_sites)
+        queries.append(
+            (remaining[is_complete], ids[is_complete], distances[is_complete])
+        )
+        remaining = remaining[~is_complete]
+        k = min(2 * k, number_of_sites)
+
+    counts = np.zeros(points.shape[0], dtype=np.int64)
+    for rows, ids, _ in queries:
+        counts[rows] = np.sum(ids < number_of_sites, axis=1)
+    offsets = np.zeros(points.shape[0] + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # The missing neighbors are last, so the neighbors of a row are consecutive.
+    indices = np.zeros(offsets[-1], dtype=np.int64)
+    neighbors_distances = np.zeros(offsets[-1])
+    for rows, ids, distances in queries:
+        is_neighbor = ids < number_of_sites
+        positions = offsets[rows, np.newaxis] + np.arange(ids.shape[1])
+        indices[positions[is_neighbor]] = ids[is_neighbor]
+        neighbors_distances[positions[is_neighbor]] = distances[is_neighbor]
+
+    return Neighbors(offsets, indices, neighbors_distances)
+
+
+def compress_neighbors(candidates, distances, is_neighbor):
+    """
+    Keep the candidates that are neighbors, in the flat layout.
+    :param candidates: Array of shape (N, k) of sites indices.
+    :param distances: Array of shape (N, k) of the distances to the candidates.
+    :param is_neighbor: Boolean array of shape (N, k).
+    :return: Neighbors of the N points.
+    """
+    offsets = np.zeros(candidates.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.sum(is_neighbor, axis=1), out=offsets[1:])
+    return Neighbors(
+        offsets, candidates[is_neighbor].astype(np.int64), distances[is_neighbor]
+    )
+
+
+def merge_neighbors(first, second):
+    """
+    Concatenate the neighbors lists of two queries of the same points.
+    The neighbors of each point are the first neighbors and then the second ones.
+    """
+    rows = np.concatenate(
+        [
+            np.repeat(np.arange(len(first.offsets) - 1), np.diff(first.offsets)),
+            np.repeat(np.arange(len(second.offsets) - 1), np.diff(second.offsets)),
+        ]
+    )
+    order = np.argsort(rows, kind="stable")
+    return Neighbors(
+        first.offsets + second.offsets,
+        np.concatenate([first.indices, second.indices])[order],
+        np.concatenate([first.distances, second.distances])[order],
+    )
+
+
+def evaluate_function(function_to_evaluate, x, y):
+    """
+    Evaluate a function on the sites.
+    Functions with an `approximate(points)` method and vectorized functions
+    are evaluated in a single call.
+    :param function_to_evaluate: f(x, y) -> value.
+    :param x: Array of x coordinates.
+    :param y: Array of y coordinates, same shape as x.
+    :return: ManifoldArray of the values, same shape as x.
+    """
+    if is_evaluated_on_arrays(function_to_evaluate):
+        values = evaluate_on_points(
+            function_to_evaluate, np.column_stack([x.ravel(), y.ravel()])
+        )
+        if not isinstance(values, ManifoldArray):
+            values = ManifoldArray(values, np.shape(values)[1:])
+        return values.reshape(x.shape)
 
-        return phi
+    evaluation = list()
+    for index in np.ndindex(x.shape):
+        evaluation.append(function_to_evaluate(x[index], y[index]))
 
+    return ManifoldArray.from_elements(evaluation, x.shape)
+
+
+# TODO: A multiscale class that aggregates points. (add_points method)
+
+
+def unittest():
     def func(x, y):
         return x
 
     grid_parameters = GridParameters(-1, 1, -1, 1, 0.2)
     collection_params = [("Grid", grid_parameters)]
-    grid = SamplingPointsCollection(
-        0.5, func, collection_params, phi_generator=_calculate_phi
-    )
-    lambdas = PolynomialReproduction(grid, "test.pkl")
+    grid = SamplingPointsCollection(0.5, func, collection_params, rbf=wendland_3_1)
+    lambdas = PolynomialReproduction(grid)
 
     lambdas_0 = lambdas.calculate(0, 0)
     lambdas_0_5 = lambdas.calculate(0, 0.5)
-    lambdas.update()
     return grid, lambdas_0, lambdas_0_5, lambdas
 
 
@@ -2,6 +2,7 @@ from Config.Options import options
 
 add_sampling_class = options.get_type_register("data_storage")
 
+from . import CellList
 from . import Grid
 from . import KDTree
 from . import SparseKDTree
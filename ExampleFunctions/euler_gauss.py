@@ -11,4 +11,4 @@ def original_function(x, y):
             0.5 * (1 - np.exp(-(y ** 2))),
             0.2 * np.cos(2 * x * y),
         ],
-    ).as_matrix()
+    ).as_quat()
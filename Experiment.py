@@ -1,4 +1,5 @@
 from datetime import datetime
+from functools import partial
 import pickle as pkl
 import numpy as np
 import time
@@ -6,8 +7,11 @@ import time
 from Config.Config import config
 from Config.Options import options
 from DataSites.Generation.Grid import get_grid
-from DataSites.GridUtils import calculate_max_derivative
-from DataSites.Storage.Grid import Grid
+from DataSites.GridUtils import (
+    calculate_approximation_max_derivative,
+    calculate_max_derivative,
+)
+from Tools.ManifoldArray import ManifoldArray
 from Tools.Results import ResultsStorage
 from Tools.Utils import *
 from DataSites.GridUtils import symmetric_grid_params
@@ -16,21 +20,149 @@ from DataSites.GridUtils import symmetric_grid_params
 config_plt(plt)
 
 
+def add_scale(values, approximation_method, points):
+    """
+    Accumulate a single scale on the values of f_{j-1}, f_j = exp(f_{j-1}, s_j).
+    :param values: ManifoldArray of shape (N,) of the values of f_{j-1} on the points.
+    :param approximation_method: The approximation method of the scale, s_j = Q(e_j).
+    :param points: Array of shape (N, 2).
+    :return: ManifoldArray of shape (N,) of the values of f_j.
+    """
+    manifold = config.MANIFOLD
+    s_j = approximation_method.approximate(points)
+
+    if not (config.IS_APPROXIMATING_ON_TANGENT or config.IS_ADAPTIVE):
+        s_j = manifold.batch_log(manifold.batch_zero_func(points), s_j)
+
+    return values.exp(manifold, s_j)
+
+
+def zero_values(points):
+    """ The values of f_0 = 0 on the points, a ManifoldArray of shape (N,) """
+    return ManifoldArray(
+        config.MANIFOLD.batch_zero_func(points), config.MANIFOLD.element_shape
+    )
+
+
+def evaluate_multiscale(approximation_methods, points):
+    """
+    Evaluate f_j = exp(f_{j-1}, s_j) on many points at once.
+    :param approximation_methods: The approximation method of each scale, s_j = Q(e_j).
+    :param points: Array of shape (N, 2).
+    :return: ManifoldArray of shape (N,) of the values of f_j.
+    """
+    # f_0 = 0
+    values = zero_values(points)
+
+    for approximation_method in approximation_methods:
+        values = add_scale(values, approximation_method, points)
+
+    return values
+
+
+def evaluate_error(approximation_methods, points):
+    """
+    Evaluate the error e_j = log(f_j, f) on many points at once,
+    from the stored scales of f_j.
+    :param approximation_methods: The approximation method of each scale of f_j.
+    :param points: Array of shape (N, 2).
+    :return: Array of shape (N, ...) of tangent vectors.
+    """
+    f_j = evaluate_multiscale(approximation_methods, points)
+    f = evaluate_on_points(config.ORIGINAL_FUNCTION, points)
+    return f_j.log(config.MANIFOLD, f)
+
+
+def evaluate_residual(approximation_methods, points):
+    """
+    Evaluate the function to interpolate in the next scale on many points at once.
+    :param approximation_methods: The approximation method of each scale of f_j.
+    :param points: Array of shape (N, 2).
+    :return: Array of shape (N, ...), e_j on the tangent space, otherwise exp(0, e_j).
+    """
+    manifold = config.MANIFOLD
+    e_j = evaluate_error(approximation_methods, points)
+
+    if config.IS_APPROXIMATING_ON_TANGENT:
+        return e_j
+
+    return manifold.batch_exp(manifold.batch_zero_func(points), e_j)
+
+
+def _scale_approximation(function_to_interpolate, scale_index):
+    """ Approximate the function in the scale_index scale """
+    scale = config.BASE_SCALE * config.SCALING_FACTOR ** scale_index
+
+    # Initializing current scale sites properties
+    fill_distance = scale / config.BASE_RESOLUTION
+    current_grid_parameters = symmetric_grid_params(
+        config.GRID_SIZE + config.GRID_BORDER, fill_distance
+    )
+
+    # Call the approximation method
+    approximation_method = options.get_option(
+        "approximation_method", config.SCALED_INTERPOLATION_METHOD
+    )(
+        function_to_interpolate,
+        current_grid_parameters,
+        scale,
+    )
+
+    return fill_distance, approximation_method
+
+
+def materialized_multiscale_approximation():
+    """
+    Run multiscale approximation, keeping f_j as the data of its scales.
+    Yields the fill distance, f_j and the approximation method of each scale.
+    Both f_j and e_j are evaluated on arrays of points, scale by scale,
+    instead of through a chain of closures.
+    """
+    approximation_methods = list()
+
+    # For all scales do
+    for scale_index in range(1, config.NUMBER_OF_SCALES + 1):
+        # e_j = log(f_{j-1}, f), on the sites of the current scale
+        function_to_interpolate = batched_function(
+            partial(evaluate_residual, list(approximation_methods))
+        )
+        if config.IS_ADAPTIVE and not config.IS_APPROXIMATING_ON_TANGENT:
+            # The tangents e_j and their points exp(0, e_j) have different shapes
+            function_to_interpolate = (
+                batched_function(partial(evaluate_error, list(approximation_methods))),
+                function_to_interpolate,
+            )
+
+        fill_distance, approximation_method = _scale_approximation(
+            function_to_interpolate, scale_index
+        )
+        approximation_methods.append(approximation_method)
+
+        # f_j = exp (f_{j-1}, s_j)
+        f_j = batched_function(
+            partial(evaluate_multiscale, list(approximation_methods))
+        )
+        yield fill_distance, f_j, approximation_method
+
+
 def multiscale_approximation():
     """
-    Run multiscale approximation
+    Run multiscale approximation.
+    Yields the fill distance, f_j and the approximation method of each scale.
     """
+    if config.IS_MATERIALIZED_PIPELINE:
+        yield from materialized_multiscale_approximation()
+        return
 
     # approximate when initial guess f_0 = 0
     f_j = config.MANIFOLD.zero_func
+    approximation_methods = list()
 
     # Initial error e_0 = log(0, f_j)
     e_j = act_on_functions(config.MANIFOLD.log, f_j, config.ORIGINAL_FUNCTION)
 
     # For all scales do
     for scale_index in range(1, config.NUMBER_OF_SCALES + 1):
-        scale = config.BASE_SCALE * config.SCALING_FACTOR ** scale_index
-
         if config.IS_APPROXIMATING_ON_TANGENT:
             function_to_interpolate = e_j
         elif config.IS_ADAPTIVE:
@@ -44,20 +176,10 @@ def multiscale_approximation():
                 config.MANIFOLD.exp, config.MANIFOLD.zero_func, e_j
             )
 
-        # Initializing current scale sites properties
-        fill_distance = scale / config.BASE_RESOLUTION
-        current_grid_parameters = symmetric_grid_params(
-            config.GRID_SIZE + config.GRID_BORDER, fill_distance
-        )
-
-        # Call the approximation method
-        approximation_method = options.get_option(
-            "approximation_method", config.SCALED_INTERPOLATION_METHOD
-        )(
-            function_to_interpolate,
-            current_grid_parameters,
-            scale,
+        fill_distance, approximation_method = _scale_approximation(
+            function_to_interpolate, scale_index
         )
+        approximation_methods.append(approximation_method)
 
         # s_j = Q(e_j)
         s_j = approximation_method.approximation
@@ -72,9 +194,12 @@ def multiscale_approximation():
         # f_j = exp (f_{j-1}, s_j)
         f_j = act_on_functions(config.MANIFOLD.exp, f_j, function_added_to_f_j)
 
+        # Evaluate f_j on arrays of points, scale by scale
+        f_j.approximate = partial(evaluate_multiscale, list(approximation_methods))
+
         # Update the error for next step
         e_j = act_on_functions(config.MANIFOLD.log, f_j, config.ORIGINAL_FUNCTION)
-        yield fill_distance, f_j
+        yield fill_distance, f_j, approximation_method
 
 
 def calculate_execution_time(func):
@@ -98,14 +223,19 @@ def run_single_experiment():
     grid_params = symmetric_grid_params(config.GRID_SIZE, config.TEST_FILL_DISTANCE)
     sites = get_grid(*grid_params)
 
+    test_points = np.column_stack([axis.ravel() for axis in sites])
+    grid_shape = sites[0].shape
+
     # Evaluate original function on the grid
-    true_values_on_grid = Grid(
-        sites, 1, config.ORIGINAL_FUNCTION, grid_params.fill_distance
-    ).evaluation
+    true_values = ManifoldArray(
+        evaluate_on_points(config.ORIGINAL_FUNCTION, test_points),
+        config.MANIFOLD.element_shape,
+    )
+    true_values_on_grid = true_values.reshape(grid_shape)
 
     # Plot the original evaluation
     config.MANIFOLD.plot(
-        true_values_on_grid,
+        true_values_on_grid.data,
         "Original",
         "original.png",
         norm_visualization=config.NORM_VISUALIZATION,
@@ -114,14 +244,22 @@ def run_single_experiment():
     # Plot max derivatives
     plot_and_save(
         calculate_max_derivative(
-            config.ORIGINAL_FUNCTION, grid_params, config.MANIFOLD
+            config.ORIGINAL_FUNCTION,
+            grid_params,
+            config.MANIFOLD,
+            center_values=true_values.data,
         ),
         "Max Derivatives",
         "derivatives.png",
     )
 
+    # The values of f_0 = 0 on the test grid, accumulated through the scales
+    approximated_values = zero_values(test_points)
+
     # Run multiscale iterations
-    for i, (fill_distance, interpolant) in enumerate(multiscale_approximation()):
+    for i, (fill_distance, _, approximation_method) in enumerate(
+        multiscale_approximation()
+    ):
         # Each scale in the multiscale, evaluate and save the error
         with set_output_directory("{}_{}".format(config.NAME, i + 1)):
             # Save the results of current scale
@@ -129,15 +267,15 @@ def run_single_experiment():
                 # pkl.dump(config, f)
                 pass
 
-            # Evaluate the approximation on the test grid
-            sites = get_grid(*grid_params)
-            approximated_values_on_grid = Grid(
-                sites, 1, interpolant, grid_params.fill_distance
-            ).evaluation
+            # Evaluate the approximation on the test grid, f_j = exp(f_{j-1}, s_j)
+            approximated_values = add_scale(
+                approximated_values, approximation_method, test_points
+            )
+            approximated_values_on_grid = approximated_values.reshape(grid_shape)
 
             # Plot the evaluation
             config.MANIFOLD.plot(
-                approximated_values_on_grid,
+                approximated_values_on_grid.data,
                 "Approximation",
                 "approximation.png",
                 norm_visualization=config.NORM_VISUALIZATION,
@@ -145,10 +283,20 @@ def run_single_experiment():
 
             # Calculate and plot the current scale's approximation error.
             error = config.MANIFOLD.calculate_error(
-                approximated_values_on_grid, true_values_on_grid
+                approximated_values_on_grid.data, true_values_on_grid.data
             )
             plot_and_save(error, "Difference Map", "difference.png")
 
+            if config.IS_PLOTTING_SCALE_DERIVATIVES:
+                # Plot the max derivatives of the current scale's approximation
+                plot_and_save(
+                    calculate_approximation_max_derivative(
+                        approximation_method, grid_params
+                    ),
+                    "Scale Max Derivatives",
+                    "scale_derivatives.png",
+                )
+
             # Calculate the l_2 norm of the error
             if config.ERROR_CALC:
                 mse = la.norm(error.ravel(), np.inf)
@@ -12,6 +12,9 @@ SYMMETRIC_ERROR = 10 ** -5
 
 
 class AbstractManifold(object):
+    # The shape of a single element, arrays of elements have the shape (..., *element_shape)
+    element_shape = ()
+
     @abstractmethod
     def exp(self, x, y):
         pass
@@ -23,22 +26,58 @@ class AbstractManifold(object):
     def distance(self, x, y):
         return la.norm(self.log(x, y))
 
+    def _act_on_batch(self, action, *arrays):
+        """
+        Apply an action on arrays of elements, one element at a time.
+        This is the naive implementation of the batch methods, manifolds should override them.
+        """
+        batch_shape = np.shape(arrays[0])[
+            : np.ndim(arrays[0]) - len(self.element_shape)
+        ]
+        results = [
+            action(*(array[index] for array in arrays))
+            for index in np.ndindex(batch_shape)
+        ]
+
+        if not results:
+            return np.zeros(batch_shape + self.element_shape)
+
+        return np.array(results).reshape(batch_shape + np.shape(results[0]))
+
+    def batch_exp(self, x, y):
+        """ exp on arrays of elements of shape (..., *element_shape) """
+        return self._act_on_batch(self.exp, x, y)
+
+    def batch_log(self, x, y):
+        """ log on arrays of elements of shape (..., *element_shape) """
+        return self._act_on_batch(self.log, x, y)
+
+    def batch_distance(self, x, y):
+        """ distance on arrays of elements, returns an array of shape (...) """
+        return self._act_on_batch(self.distance, x, y)
+
+    def batch_zero_func(self, points):
+        """ zero_func on an array of points of shape (N, 2) """
+        return np.array([self.zero_func(x, y) for x, y in points])
+
     def calculate_error(self, x, y):
-        error = np.zeros_like(x, dtype=np.float32)
-        for index in np.ndindex(x.shape):
-            # Relative Error
-            error[index] = self.distance(x[index], y[index])
-        return error
+        """
+        :param x: Array of elements of shape (..., *element_shape).
+        :param y: Array of elements of the same shape.
+        :return: Array of shape (...) of the distances.
+        """
+        # Relative Error
+        return self.batch_distance(x, y).astype(np.float32)
 
     @abstractmethod
     def _to_numbers(self, x):
         pass
 
+    def _batch_to_numbers(self, data):
+        return self._act_on_batch(self._to_numbers, data)
+
     def _visualize(self, plt, data):
-        visualization = np.zeros_like(data, dtype=np.float32)
-        for index in np.ndindex(visualization.shape):
-            x = data[index]
-            visualization[index] = self._to_numbers(x)
+        visualization = self._batch_to_numbers(data).astype(np.float32)
         fig = plt.imshow(visualization, cmap=config.cmap)
         fig.axes.get_xaxis().set_visible(False)
         fig.axes.get_yaxis().set_visible(False)
@@ -69,25 +108,51 @@ class AbstractManifold(object):
         line = self._get_geodetic_line(x, y)
         return line(ratio)
 
+    def _batch_geodesic_average_two_points(self, x, y, w_x, w_y):
+        """
+        _geodesic_average_two_points on arrays of pairs.
+        :param x: Array of shape (N, *element_shape).
+        :param y: Array of shape (N, *element_shape).
+        :param w_x: Array of shape (N,).
+        :param w_y: Array of shape (N,).
+        :return: Array of shape (N, *element_shape).
+        """
+        return np.array(
+            [self._geodesic_average_two_points(*pair) for pair in zip(x, y, w_x, w_y)]
+        ).reshape(np.shape(x))
+
     def _geodesic_average(self, values_to_average, weights):
         """
-        This calculation is recursive because we always know to
-        calculate the geodetic average only for a couple of points.
+        Average the first point with the last one, and replace both with
+        the average and their total weight, until a single point is left.
+        The values are not changed, they can be a list or an array view.
         """
-        average = self._geodesic_average_two_points(
-            values_to_average[0], values_to_average[-1], weights[0], weights[-1]
-        )
+        average = values_to_average[0]
+        total_weight = weights[0]
+        for index in range(len(values_to_average) - 1, 0, -1):
+            average = self._geodesic_average_two_points(
+                average, values_to_average[index], total_weight, weights[index]
+            )
+            total_weight += weights[index]
+
+        return average
 
-        values_to_average = values_to_average[:-1]
-        new_weight = weights[0] + weights[-1]
-        values_to_average[0] = average
-        weights = weights[:-1]
-        weights[0] = new_weight
+    def batch_geodesic_average(self, values_to_average, weights):
+        """
+        _geodesic_average of many averaging problems at once.
+        :param values_to_average: Array of shape (N, k, *element_shape).
+        :param weights: Array of shape (N, k). Padding values should have zero weights.
+        :return: Array of shape (N, *element_shape).
+        """
+        average = values_to_average[:, 0]
+        total_weight = weights[:, 0]
+        for index in range(values_to_average.shape[1] - 1, 0, -1):
+            average = self._batch_geodesic_average_two_points(
+                average, values_to_average[:, index], total_weight, weights[:, index]
+            )
+            total_weight = total_weight + weights[:, index]
 
-        if len(values_to_average) == 1:
-            return values_to_average[0]
-        else:
-            return self._geodesic_average(values_to_average, weights)
+        return average
 
     @abstractmethod
     def _karcher_mean(self, values_to_average, weights, base=None, iterations=0):
@@ -100,6 +165,23 @@ class AbstractManifold(object):
         """
         return self._geodesic_average(values_to_average, weights)
 
+    def average_by_operator(self, operator, values):
+        """
+        Average the values with each row of a sparse weights operator.
+        :param operator: CSR matrix of shape (N, n).
+        :param values: Array of shape (n, ...).
+        :return: Array of shape (N, ...) of the averages.
+        """
+        return np.array(
+            [
+                self.average(
+                    list(values[operator.indices[start:end]]),
+                    list(operator.data[start:end]),
+                )
+                for start, end in zip(operator.indptr[:-1], operator.indptr[1:])
+            ]
+        )
+
 
 if __name__ == "__main__":
     # main()
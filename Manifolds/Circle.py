@@ -1,9 +1,32 @@
 import numpy as np
 from numpy import linalg as la
 
+from Config.Config import config
+from Tools.Utils import apply_operator, pad_operator
+
 from .AbstractManifold import AbstractManifold
 from . import register_manifold
 
+# The averages of CircleAngles, see config.CIRCLE_AVERAGING
+GEODESIC_AVERAGING = "geodesic"
+CIRCULAR_AVERAGING = "circular"
+
+
+def wrap_angles(angles):
+    """ The representatives of angles in [-pi, pi) """
+    return np.mod(np.add(angles, np.pi), 2 * np.pi) - np.pi
+
+
+def angles_from_vectors(vectors):
+    """ The angles of unit 2-vectors, (..., 2) -> (...) """
+    vectors = np.asarray(vectors)
+    return np.arctan2(vectors[..., 1], vectors[..., 0])
+
+
+def vectors_from_angles(angles):
+    """ The unit 2-vectors of angles, (...) -> (..., 2) """
+    return np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+
 
 @register_manifold("circle")
 class Circle(AbstractManifold):
@@ -11,6 +34,8 @@ class Circle(AbstractManifold):
     S2 retraction pairs
     """
 
+    element_shape = (2,)
+
     def exp(self, x, y):
         z = x + y
         return z / la.norm(z, ord=2)
@@ -21,6 +46,18 @@ class Circle(AbstractManifold):
             inner_product = 0.00001
         return (y / np.abs(inner_product)) - x
 
+    def batch_exp(self, x, y):
+        z = np.add(x, y)
+        return z / la.norm(z, ord=2, axis=-1, keepdims=True)
+
+    def batch_log(self, x, y):
+        inner_product = np.sum(np.multiply(x, y), axis=-1, keepdims=True)
+        inner_product = np.where(inner_product == 0, 0.00001, inner_product)
+        return (y / np.abs(inner_product)) - x
+
+    def batch_distance(self, x, y):
+        return la.norm(self.batch_log(x, y), axis=-1)
+
     def _to_numbers(self, x):
         """
         WARNING! this usage of arctan can be missleading - it can choose the
@@ -29,12 +66,18 @@ class Circle(AbstractManifold):
         """
         return np.arctan2(x[1], x[0])
 
+    def _batch_to_numbers(self, data):
+        return angles_from_vectors(data)
+
     def gen_point(self, phi):
-        return np.array([np.cos(phi), np.sin(phi)])
+        return vectors_from_angles(phi)
 
     def zero_func(self, x_0, x_1):
         return np.array([0, 1])
 
+    def batch_zero_func(self, points):
+        return np.tile(np.array([0, 1]), (len(points), 1))
+
     def _get_geodetic_line(self, x, y):
         theta_x = np.arctan2(x[1], x[0])
         theta_y = np.arctan2(y[1], y[0])
@@ -49,3 +92,108 @@ class Circle(AbstractManifold):
             return self.gen_point(theta)
 
         return line
+
+    def _batch_geodesic_average_two_points(self, x, y, w_x, w_y):
+        theta_x = angles_from_vectors(x)
+        theta_y = angles_from_vectors(y)
+        # Move the larger angle by 2pi to average along the short arc
+        is_far = np.abs(theta_x - theta_y) >= np.pi
+        is_x_larger = theta_x > theta_y
+        theta_x = np.where(is_far & is_x_larger, theta_x - 2 * np.pi, theta_x)
+        theta_y = np.where(is_far & ~is_x_larger, theta_y - 2 * np.pi, theta_y)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = w_x / (w_x + w_y)
+        theta = theta_x + ((theta_y - theta_x) * (1 - ratio))
+        average = vectors_from_angles(theta)
+
+        average = np.where((w_x == 0)[..., np.newaxis], y, average)
+        return np.where((w_y == 0)[..., np.newaxis], x, average)
+
+    def average_by_operator(self, operator, values):
+        values_to_average, weights = pad_operator(
+            operator, values, self.zero_func(0, 0)
+        )
+        return self.batch_geodesic_average(values_to_average, weights)
+
+
+@register_manifold("circle_angles")
+class CircleAngles(Circle):
+    """
+    S1 with the points kept as angles in [-pi, pi), so fields of points are float arrays.
+    Use vectors_from_angles and angles_from_vectors to move between the representations.
+    The average is the geodesic average of Circle, or the weighted circular mean
+    (the angle of the weighted sum of the unit vectors) by config.CIRCLE_AVERAGING.
+    """
+
+    element_shape = ()
+
+    def exp(self, x, y):
+        return wrap_angles(np.add(x, y))
+
+    def log(self, x, y):
+        return wrap_angles(np.subtract(y, x))
+
+    def distance(self, x, y):
+        return np.abs(self.log(x, y))
+
+    def batch_exp(self, x, y):
+        return self.exp(x, y)
+
+    def batch_log(self, x, y):
+        return self.log(x, y)
+
+    def batch_distance(self, x, y):
+        return self.distance(x, y)
+
+    def _to_numbers(self, x):
+        return wrap_angles(x)
+
+    def _batch_to_numbers(self, data):
+        return wrap_angles(data)
+
+    def gen_point(self, phi):
+        return wrap_angles(phi)
+
+    def zero_func(self, x_0, x_1):
+        return np.pi / 2
+
+    def batch_zero_func(self, points):
+        return np.full(len(points), np.pi / 2)
+
+    def _get_geodetic_line(self, x, y):
+        difference = self.log(x, y)
+
+        def line(t):
+            return self.exp(x, difference * (1 - t))
+
+        return line
+
+    def _batch_geodesic_average_two_points(self, x, y, w_x, w_y):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = w_x / (w_x + w_y)
+        average = self.exp(x, self.log(x, y) * (1 - ratio))
+
+        average = np.where(w_x == 0, y, average)
+        return np.where(w_y == 0, x, average)
+
+    def average(self, values_to_average, weights):
+        if config.CIRCLE_AVERAGING == GEODESIC_AVERAGING:
+            return super().average(values_to_average, weights)
+        if config.CIRCLE_AVERAGING == CIRCULAR_AVERAGING:
+            return np.arctan2(
+                np.dot(weights, np.sin(values_to_average)),
+                np.dot(weights, np.cos(values_to_average)),
+            )
+        raise ValueError(f"Unknown circle averaging {config.CIRCLE_AVERAGING}")
+
+    def average_by_operator(self, operator, values):
+        if config.CIRCLE_AVERAGING == GEODESIC_AVERAGING:
+            return super().average_by_operator(operator, values)
+        if config.CIRCLE_AVERAGING == CIRCULAR_AVERAGING:
+            # Two sparse products, like the average of RealNumbers.
+            return np.arctan2(
+                apply_operator(operator, np.sin(values)),
+                apply_operator(operator, np.cos(values)),
+            )
+        raise ValueError(f"Unknown circle averaging {config.CIRCLE_AVERAGING}")
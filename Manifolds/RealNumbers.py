@@ -1,5 +1,6 @@
 import numpy as np
 
+from Tools.Utils import apply_operator
 from .AbstractManifold import AbstractManifold
 from . import register_manifold
 
@@ -12,39 +13,53 @@ class RealNumbers(AbstractManifold):
     def log(self, x, y):
         return y - x
 
+    def batch_exp(self, x, y):
+        return np.add(x, y)
+
+    def batch_log(self, x, y):
+        return np.subtract(y, x)
+
+    def batch_distance(self, x, y):
+        return np.abs(self.batch_log(x, y))
+
     def _to_numbers(self, x):
         return x
 
+    def _batch_to_numbers(self, data):
+        return np.asarray(data)
+
     def zero_func(self, x_0, x_1):
         return 2
 
+    def batch_zero_func(self, points):
+        return np.full(len(points), 2)
+
     def _get_geodetic_line(self, x, y):
         def line(t):
             return x + (y - x) * (1 - t)
 
         return line
 
+    def average_by_operator(self, operator, values):
+        # The geodesic average of numbers is the normalized weighted sum.
+        normalizer = np.asarray(operator.sum(axis=1)).ravel()
+        normalizer[normalizer == 0] = 1
+        return apply_operator(operator, values) / normalizer
+
 
 @register_manifold("no_norm")
 class NoNormalizationNumbers(RealNumbers):
     def average(self, values_to_average, weights):
         return sum([w_i * v_i for w_i, v_i in zip(weights, values_to_average)])
 
-    def calculate_error(self, x, y):
-        """ Relative Error """
-        error = np.zeros_like(x, dtype=np.float32)
-        for index in np.ndindex(x.shape):
-            error[index] = self.distance(x[index], y[index])
-        return error
+    def average_by_operator(self, operator, values):
+        return apply_operator(operator, values)
 
 
 @register_manifold("no_norm_calibration")
 class Calibration(NoNormalizationNumbers):
     def calculate_error(self, x, y):
-        error = np.zeros_like(x, dtype=np.float32)
-        for index in np.ndindex(x.shape):
-            error[index] = x[index] / y[index]
-        return error
+        return np.divide(x, y).astype(np.float32)
 
 
 class PositiveNumbers(RealNumbers):
@@ -58,3 +73,10 @@ class PositiveNumbers(RealNumbers):
         else:
             epsilon = 0
         return np.log(y) / (np.log(x) + epsilon)
+
+    def batch_exp(self, x, y):
+        return np.power(x, y)
+
+    def batch_log(self, x, y):
+        epsilon = np.where(np.equal(x, 1), 0.00001, 0)
+        return np.log(y) / (np.log(x) + epsilon)
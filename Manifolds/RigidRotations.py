@@ -1,4 +1,3 @@
-import scipy
 import numpy as np
 from numpy import linalg as la
 
@@ -6,27 +5,55 @@ from pyquaternion import Quaternion
 from scipy.stats import special_ortho_group
 from scipy.spatial.transform import Rotation
 
+from Config.Config import config
 from Tools.KarcherMean import KarcherMean
+from Tools.Rotations import (
+    matrices_from_quaternions,
+    quaternion_chordal_mean,
+    quaternion_conjugate,
+    quaternion_exp,
+    quaternion_log,
+    quaternion_multiply,
+    quaternions_from_matrices,
+)
+from Tools.Utils import pad_operator
 from Tools.Visualization import RotationVisualizer
 
 from .AbstractManifold import AbstractManifold
 from . import register_manifold
 
-SPECIAL_TOLERANCE = 0.001
-ORTHOGONAL_TOLERANCE = 0.001
+UNIT_TOLERANCE = 0.001
+
+# The identity rotation, as a scalar-last quaternion
+IDENTITY = np.array([0.0, 0.0, 0.0, 1.0])
+
+GEODESIC_AVERAGING = "geodesic"
+CHORDAL_AVERAGING = "chordal"
+REFINED_CHORDAL_AVERAGING = "refined_chordal"
 
 
 @register_manifold("rotations")
 class RigidRotations(AbstractManifold):
+    """
+    SO(3) with the elements kept as unit quaternions, scalar-last (x, y, z, w).
+    The tangent vectors are axis-angle vectors. Use matrices_from_quaternions and
+    quaternions_from_matrices (Tools.Rotations) to move between the representations.
+    """
+
+    element_shape = (4,)
+
     def __init__(self, dim=3):
         super().__init__()
         self.dim = dim
 
     def zero_func(self, x_0, x_1):
-        return np.eye(self.dim)
+        return IDENTITY.copy()
+
+    def batch_zero_func(self, points):
+        return np.tile(IDENTITY, (len(points), 1))
 
     def distance(self, x, y):
-        return la.norm(self.log(x, y))
+        return self.batch_distance(x, y)
 
     def _quaternion_from_matrix(self, matrix):
         """
@@ -43,45 +70,49 @@ class RigidRotations(AbstractManifold):
         return Rotation.from_quat(quaternion.elements).as_matrix()
 
     def log(self, x, y):
-        return scipy.linalg.logm(np.matmul(la.inv(x), y))
+        return self.batch_log(x, y)
 
     def exp(self, x, y):
-        return np.matmul(x, scipy.linalg.expm(y))
+        return self.batch_exp(x, y)
 
-    def gen_point(self):
-        matrix = np.array(special_ortho_group.rvs(self.dim))
-        return matrix
+    @staticmethod
+    def _relative_rotation(x, y):
+        """ x^(-1) y, for unit quaternions """
+        return quaternion_multiply(quaternion_conjugate(x), y)
 
-    def zero_func(self, x_0, x_1):
-        return np.eye(self.dim)
+    def batch_log(self, x, y):
+        """ The closed form LOG(x^(-1) y), as axis-angle vectors """
+        return quaternion_log(self._relative_rotation(x, y))
+
+    def batch_exp(self, x, y):
+        """ x EXP(y), of axis-angle vectors """
+        product = quaternion_multiply(x, quaternion_exp(np.asarray(y)))
+        # Keep a unit norm, so the round-off does not accumulate through the scales.
+        return product / la.norm(product, axis=-1, keepdims=True)
+
+    def batch_distance(self, x, y):
+        # sqrt(2) times the angle, the Frobenius norm of the log as a skew symmetric matrix
+        return np.sqrt(2) * la.norm(self.batch_log(x, y), axis=-1)
 
-    def is_in_manifold(self, matrix):
+    def gen_point(self):
+        return quaternions_from_matrices(special_ortho_group.rvs(self.dim))
+
+    def is_in_manifold(self, quaternion):
         """
-        Is in SO(3) predicate.
-        :param matrix: Examined matrix.
+        Is in SO(3) predicate, the quaternion should have a unit norm.
+        :param quaternion: Examined quaternion.
         :return: bool
         """
-        is_orthogonal = (
-            la.norm(np.matmul(matrix, np.transpose(matrix)) - np.eye(self.dim))
-            < ORTHOGONAL_TOLERANCE
-        )
-        is_special = np.abs(la.det(matrix) - 1) < SPECIAL_TOLERANCE
-        answer = is_special and is_orthogonal
-        if not answer:
-            print(matrix, is_special, is_orthogonal)
-        return answer
+        return np.abs(la.norm(quaternion) - 1) < UNIT_TOLERANCE
 
     def geodesic_l2_mean_step(
         self, current_estimator, noisy_samples, weights, tolerance=0.00000001
     ):
         projected_diff_samples = [
-            w_i
-            * scipy.linalg.logm(
-                np.matmul(np.linalg.inv(current_estimator), noisy_sample)
-            )
+            w_i * self.log(current_estimator, noisy_sample)
             for w_i, noisy_sample in zip(weights, noisy_samples)
         ]
-        matrices_sum = np.zeros(projected_diff_samples[0].shape, dtype="complex128")
+        matrices_sum = np.zeros(projected_diff_samples[0].shape)
         for projected_diff_matrix in projected_diff_samples:
             matrices_sum += projected_diff_matrix
         r = matrices_sum / sum(weights)
@@ -90,7 +121,7 @@ class RigidRotations(AbstractManifold):
             state_of_convergence = True
             return current_estimator, state_of_convergence
         else:
-            new_estimator = np.matmul(current_estimator, scipy.linalg.expm(r))
+            new_estimator = self.exp(current_estimator, r)
             state_of_convergence = False
             return new_estimator, state_of_convergence
 
@@ -110,18 +141,109 @@ class RigidRotations(AbstractManifold):
             run_index += 1
         return mean_estimator_list
 
-    def average(self, values_to_average, weights, base=np.eye(3)):
+    def batch_geodesic_l2_mean(
+        self, values_to_average, weights, tolerance=0.00000001, maximum_iteration=10
+    ):
+        """
+        geodesic_l2_mean of many averaging problems at once, on unit quaternions.
+        Every iteration updates only the problems that did not converge yet.
+        :param values_to_average: Quaternions of shape (N, k, 4).
+        :param weights: Array of shape (N, k). Padding values should have zero weights.
+        :return: The means, shape (N, 4), and the iterations of each mean.
+        """
+        samples = np.asarray(values_to_average)
+        weights = np.asarray(weights)
+
+        mean_estimators = samples[:, 0].copy()
+        iterations = np.zeros(samples.shape[0], dtype=int)
+        active = np.arange(samples.shape[0])
+
+        for run_index in range(1, maximum_iteration + 1):
+            r = self._batch_projected_average(
+                mean_estimators[active], samples[active], weights[active]
+            )
+            iterations[active] = run_index
+
+            is_converged = la.norm(r, axis=-1) < tolerance
+            active = active[~is_converged]
+            mean_estimators[active] = quaternion_multiply(
+                mean_estimators[active], quaternion_exp(r[~is_converged])
+            )
+            if active.shape[0] == 0:
+                break
+
+        return mean_estimators, iterations
+
+    @staticmethod
+    def _batch_projected_average(mean_estimators, samples, weights):
+        """
+        The weighted average of the samples in the tangent space of the estimators.
+        :param mean_estimators: Quaternions of shape (N, 4).
+        :param samples: Quaternions of shape (N, k, 4).
+        :param weights: Array of shape (N, k).
+        :return: Axis-angle vectors of shape (N, 3).
+        """
+        # The axis-angle vectors of estimator^(-1) sample
+        projected_diff_samples = quaternion_log(
+            quaternion_multiply(
+                quaternion_conjugate(mean_estimators[:, np.newaxis]), samples
+            )
+        )
+        return (
+            np.sum(weights[..., np.newaxis] * projected_diff_samples, axis=1)
+            / np.sum(weights, axis=1)[:, np.newaxis]
+        )
+
+    def batch_chordal_l2_mean(self, values_to_average, weights, is_refined=False):
+        """
+        The closed form chordal L2 mean of many averaging problems at once.
+        It is close to the geodesic mean when the samples are close to each other.
+        :param values_to_average: Quaternions of shape (N, k, 4).
+        :param weights: Array of shape (N, k). Padding values should have zero weights.
+        :param is_refined: Add a single step of geodesic_l2_mean after the chordal mean.
+        :return: The means, shape (N, 4).
+        """
+        samples = np.asarray(values_to_average)
+        weights = np.asarray(weights)
+        mean_estimators = quaternion_chordal_mean(samples, weights)
+        if is_refined:
+            mean_estimators = quaternion_multiply(
+                mean_estimators,
+                quaternion_exp(
+                    self._batch_projected_average(mean_estimators, samples, weights)
+                ),
+            )
+        return mean_estimators
+
+    def average(self, values_to_average, weights, base=IDENTITY):
         return self.geodesic_l2_mean(values_to_average, weights)[-1]
 
+    def average_by_operator(self, operator, values):
+        # Average all the rows together, padded by the identity with zero weights.
+        values_to_average, weights = pad_operator(operator, values, IDENTITY)
+        if config.ROTATIONS_AVERAGING == GEODESIC_AVERAGING:
+            return self.batch_geodesic_l2_mean(values_to_average, weights)[0]
+        if config.ROTATIONS_AVERAGING in (CHORDAL_AVERAGING, REFINED_CHORDAL_AVERAGING):
+            return self.batch_chordal_l2_mean(
+                values_to_average,
+                weights,
+                is_refined=config.ROTATIONS_AVERAGING == REFINED_CHORDAL_AVERAGING,
+            )
+        raise ValueError(f"Unknown rotations averaging {config.ROTATIONS_AVERAGING}")
+
     def _to_numbers(self, x):
-        return self.distance(x, np.eye(3))
+        return self.distance(x, IDENTITY)
+
+    def _batch_to_numbers(self, data):
+        return self.batch_distance(data, IDENTITY)
 
     def plot(self, data, title, filename, norm_visualization=False):
         if norm_visualization:
             return super().plot(data, title, filename)
-        centers = np.zeros_like(data, dtype=object)
-        for index in np.ndindex(data.shape):
-            centers[index] = np.array([index[0], index[1], 0])
+        data = matrices_from_quaternions(data)
+        grid_shape = data.shape[:2]
+        centers = np.zeros(grid_shape + (3,))
+        centers[..., :2] = np.moveaxis(np.indices(grid_shape), 0, -1)
         print("start to visualize")
         RotationVisualizer(data, centers).save(filename, title)
 
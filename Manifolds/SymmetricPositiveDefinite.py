@@ -1,10 +1,18 @@
 import numpy as np
 from numpy import linalg as la
 
-from scipy.linalg import expm, logm, sqrtm
+from scipy.linalg import logm, sqrtm
 from sklearn.datasets import make_spd_matrix
 
-from Tools.KarcherMean import KarcherMean
+from Tools.KarcherMean import BatchKarcherMean, KarcherMean
+from Tools.SymmetricMatrices import (
+    congruence,
+    sqrt_and_inv_sqrt,
+    symmetric_expm,
+    symmetric_logm,
+    symmetrize,
+)
+from Tools.Utils import pad_operator
 from Tools.Visualization import EllipsoidVisualizer
 
 from .AbstractManifold import AbstractManifold
@@ -18,6 +26,7 @@ class SymmetricPositiveDefinite(AbstractManifold):
     def __init__(self, dim=3):
         super().__init__()
         self.dim = dim
+        self.element_shape = (dim, dim)
 
     def is_in_manifold(self, x):
         return all(
@@ -27,34 +36,57 @@ class SymmetricPositiveDefinite(AbstractManifold):
             ]
         )
 
+    def batch_is_in_manifold(self, x):
+        """ is_in_manifold on arrays of matrices, returns an array of shape (...) """
+        is_symmetric = (
+            la.norm(x - np.swapaxes(x, -1, -2), axis=(-2, -1)) < SYMMETRIC_ERROR
+        )
+        is_positive = np.all(la.eigvalsh(symmetrize(x)) > 0, axis=-1)
+        return is_symmetric & is_positive
+
     def exp(self, x, y):
-        sqrt_x = sqrtm(x)
-        exp_param = self._calculate_log_param(x, y)
-        return np.matmul(np.matmul(sqrt_x, expm(exp_param)), sqrt_x)
+        return self.batch_exp(x, y)
 
     def _calculate_log_param(self, x, y):
-        sqrt_x = sqrtm(x)
-        inv_sqrt_x = la.inv(sqrt_x)
-        return np.matmul(np.matmul(inv_sqrt_x, y), inv_sqrt_x)
+        _, inv_sqrt_x = sqrt_and_inv_sqrt(x)
+        return congruence(inv_sqrt_x, y)
 
     def log(self, x, y):
-        sqrt_x = sqrtm(x)
-        log_param = self._calculate_log_param(x, y)
-        return np.matmul(np.matmul(sqrt_x, logm(log_param)), sqrt_x)
+        return self.batch_log(x, y)
 
     def distance(self, x, y):
-        log_param = self._calculate_log_param(x, y)
-        return la.norm(logm(log_param))
+        return self.batch_distance(x, y)
+
+    def batch_exp(self, x, y):
+        """ x^(1/2) EXP(x^(-1/2) y x^(-1/2)) x^(1/2), from one eigendecomposition of x """
+        sqrt_x, inv_sqrt_x = sqrt_and_inv_sqrt(x)
+        return congruence(sqrt_x, symmetric_expm(congruence(inv_sqrt_x, y)))
+
+    def batch_log(self, x, y):
+        """ x^(1/2) LOG(x^(-1/2) y x^(-1/2)) x^(1/2), from one eigendecomposition of x """
+        sqrt_x, inv_sqrt_x = sqrt_and_inv_sqrt(x)
+        return congruence(sqrt_x, symmetric_logm(congruence(inv_sqrt_x, y)))
+
+    def batch_distance(self, x, y):
+        # The norm of LOG(x^(-1/2) y x^(-1/2)) is the norm of the log of its eigenvalues.
+        eigenvalues = la.eigvalsh(symmetrize(self._calculate_log_param(x, y)))
+        return la.norm(np.log(eigenvalues), axis=-1)
 
     def _to_numbers(self, x):
         return la.norm(x, ord=2)
 
+    def _batch_to_numbers(self, data):
+        return la.norm(data, ord=2, axis=(-2, -1))
+
     def gen_point(self):
         return make_spd_matrix(self.dim)
 
     def zero_func(self, x_0, x_1):
         return np.eye(self.dim)
 
+    def batch_zero_func(self, points):
+        return np.tile(np.eye(self.dim), (len(points), 1, 1))
+
     def _get_geodetic_line(self, x, y):
         sqrt_x = sqrtm(x)
         log_param = self._calculate_log_param(x, y)
@@ -70,12 +102,18 @@ class SymmetricPositiveDefinite(AbstractManifold):
     def average(self, values_to_average, weights):
         return self._karcher_mean(values_to_average, weights)
 
+    def average_by_operator(self, operator, values):
+        # Average all the rows together, padded by the identity with zero weights.
+        values_to_average, weights = pad_operator(operator, values, np.eye(self.dim))
+        return BatchKarcherMean(self, values_to_average, weights).get_average()
+
     def plot(self, data, title, filename, norm_visualization=False):
         if norm_visualization:
             return super().plot(data, title, filename)
-        centers = np.zeros_like(data, dtype=object)
-        for index in np.ndindex(data.shape):
-            centers[index] = np.array([index[0], index[1], 0])
+        data = np.asarray(data)
+        grid_shape = data.shape[:2]
+        centers = np.zeros(grid_shape + (3,))
+        centers[..., :2] = np.moveaxis(np.indices(grid_shape), 0, -1)
         print("start to visualize")
         EllipsoidVisualizer(data, centers).save(filename, title)
 
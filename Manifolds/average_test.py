@@ -6,6 +6,7 @@ from numpy import linalg as la
 from pyquaternion import Quaternion
 from scipy.spatial.transform import Rotation
 
+from Tools.Rotations import matrices_from_quaternions
 from Tools.Visualization import RotationVisualizer
 from .RigidRotations import RigidRotations
 
@@ -31,18 +32,20 @@ def generate_triangle(levels, scale):
 
 
 def average_test():
-    x_rot = (Rotation.from_euler("x", 0.5)).as_matrix()
-    y_rot = (Rotation.from_euler("y", 0.5)).as_matrix()
-    z_rot = (Rotation.from_euler("z", 0.5)).as_matrix()
+    x_rot = (Rotation.from_euler("x", 0.5)).as_quat()
+    y_rot = (Rotation.from_euler("y", 0.5)).as_quat()
+    z_rot = (Rotation.from_euler("z", 0.5)).as_quat()
 
     m = RigidRotations()
     triangles = list(generate_triangle(4, 8))
-    matrices = np.zeros(len(triangles), dtype=object)
-    centers = np.zeros(len(triangles), dtype=object)
+    matrices = np.zeros((len(triangles), 3, 3))
+    centers = np.zeros((len(triangles), 3))
 
     for i, p in enumerate(triangles):
         print("Now: ", i / len(triangles))
-        matrices[i] = m.average([x_rot, y_rot, z_rot], [p.w_x, p.w_y, p.w_z])
+        matrices[i] = matrices_from_quaternions(
+            m.average([x_rot, y_rot, z_rot], [p.w_x, p.w_y, p.w_z])
+        )
         centers[i] = np.array([p.x, p.y, 0])
 
     visualizer = RotationVisualizer(matrices, centers)
@@ -24,7 +24,8 @@ def main():
         "GRID_SIZE": 0.95,
         "BASE_SCALE": 0.2,
         "BASE_RESOLUTION": 2,
-        "TEST_FILL_DISTANCE": 0.008,
+        # Every sites grid refines to the test grid, so the quasi-interpolation is a convolution
+        "TEST_FILL_DISTANCE": 0.00625,
         "SCALING_FACTOR": 0.5,
         "cmap": "gray",
     }
@@ -1,24 +1,45 @@
 """
 List of functions to examine
 """
-# TODO: add option to get an image.
 # TODO: add an option to get any data.
+import os
+
 import numpy as np
-from PIL import ImageOps, Image
+from PIL import Image
 from scipy.spatial.transform import Rotation
 
+from Config.Config import config
 from Config.Options import options
+from Manifolds.Circle import vectors_from_angles, wrap_angles
+from Tools.ArrayCache import ArrayCache, content_key
+from Tools.Utils import vectorized_function
 
-register_function = options.get_type_register("original_function")
+_register_function = options.get_type_register("original_function")
 FUNCTIONS = dict()
 
 
-@register_function("numbers")
+def register_function(name, vectorized=False):
+    """
+    Register an original function f(x, y).
+    :param name: The option name.
+    :param vectorized: Does f also evaluate arrays x, y of shape (N,), returning an array of shape (N, ...).
+        Vectorized functions are evaluated on all the points at once.
+    """
+
+    def decorator(func):
+        if vectorized:
+            func = vectorized_function(func)
+        return _register_function(name)(func)
+
+    return decorator
+
+
+@register_function("numbers", vectorized=True)
 def numbers(x, y):
     return np.sin(4 * x) * np.cos(5 * y)
 
 
-@register_function("numbers_gauss")
+@register_function("numbers_gauss", vectorized=True)
 def numbers_gauss(x, y):
     return 5 * (np.exp(-(x ** 2) - y ** 2))
 
@@ -28,66 +49,159 @@ def one(*_):
     return 1
 
 
-@register_function("numbers_sin")
+@register_function("numbers_sin", vectorized=True)
 def numbers_sin(x, y):
     return np.sin(2 * (x + 0.5)) * np.cos((3 * (y + 0.5)))
 
 
-@register_function("anomaly_synthetic")
+@register_function("anomaly_synthetic", vectorized=True)
 def anomaly_synthetic(x, y):
     ans = np.sin(x) + np.cos(y)
-    if 0.1 < x < 0.25 and 0.2 < y < 0.4:
-        ans = ans * 1.01
-
-    return ans
-
-
-def generate_image_function(name, filename):
-    _img = ImageOps.grayscale(Image.open(filename).rotate(90))
-    img = np.array(_img) / 255
+    is_anomaly = (0.1 < x) & (x < 0.25) & (0.2 < y) & (y < 0.4)
+
+    return np.where(is_anomaly, ans * 1.01, ans)
+
+
+def load_image(filename, mode="L"):
+    """
+    Decode the image once to a cached .npy file, and memory-map its pixels.
+    The decoded images are kept in config.IMAGES_CACHE_DIRECTORY,
+    keyed by the path of the image, its modification time and the mode.
+    :param filename: The image file.
+    :param mode: PIL mode of the pixels, "L" for grayscale or "RGB" for multi-channel.
+    :return: Read only array of shape (rows, columns) or (rows, columns, channels), in [0, 1].
+    """
+    cache = ArrayCache(config.IMAGES_CACHE_DIRECTORY)
+    key = content_key(
+        "image", os.path.abspath(filename), os.path.getmtime(filename), mode
+    )
+    if key not in cache:
+        img = Image.open(filename).rotate(90).convert(mode)
+        cache[key] = np.asarray(img, dtype=np.float32) / 255
+
+    return cache[key]
+
+
+def _image_coordinates(x, size):
+    """ The continuous pixel coordinate of x in [-1, 1], the pixel i covers [i, i + 1) """
+    return ((np.asarray(x) + 0.95) / 2) * size
+
+
+def _sample_nearest(img, x, y):
+    # Coordinates off the image take the pixels of its border.
+    rows = np.clip(np.trunc(_image_coordinates(x, img.shape[0])), 0, img.shape[0] - 1)
+    columns = np.clip(
+        np.trunc(_image_coordinates(y, img.shape[1])), 0, img.shape[1] - 1
+    )
+    return img[rows.astype(np.int64), columns.astype(np.int64)]
+
+
+def _sample_bilinear(img, x, y):
+    # Interpolate between the centers of the pixels
+    rows = _image_coordinates(x, img.shape[0]) - 0.5
+    columns = _image_coordinates(y, img.shape[1]) - 0.5
+    row_0 = np.floor(rows)
+    column_0 = np.floor(columns)
+
+    def pixels(row, column):
+        return img[
+            np.clip(row, 0, img.shape[0] - 1).astype(np.int64),
+            np.clip(column, 0, img.shape[1] - 1).astype(np.int64),
+        ]
+
+    # Weights of shape (..., 1) for multi-channel images
+    extra_axes = (np.newaxis,) * (img.ndim - 2)
+    row_weights = (rows - row_0)[(...,) + extra_axes]
+    column_weights = (columns - column_0)[(...,) + extra_axes]
+    top = _interpolate(
+        pixels(row_0, column_0), pixels(row_0, column_0 + 1), column_weights
+    )
+    bottom = _interpolate(
+        pixels(row_0 + 1, column_0), pixels(row_0 + 1, column_0 + 1), column_weights
+    )
+    return _interpolate(top, bottom, row_weights)
+
+
+def _interpolate(a, b, t):
+    return (1 - t) * a + t * b
+
+
+IMAGE_SAMPLING = {"nearest": _sample_nearest, "bilinear": _sample_bilinear}
+
+
+def generate_image_function(name, filename, sampling="nearest", mode="L"):
+    """
+    Register an image as a vectorized original function on [-1, 1]^2.
+    :param name: The option name.
+    :param filename: The image file.
+    :param sampling: "nearest" or "bilinear".
+    :param mode: PIL mode of the pixels, "L" for grayscale or "RGB" for multi-channel.
+    """
+    img = load_image(filename, mode)
+    sample = IMAGE_SAMPLING[sampling]
 
     def image(x, y):
-        if x > 1 or x < -1:
-            import ipdb
-
-            ipdb.set_trace()
-        try:
-            x = int(((x + 0.95) / 2) * img.shape[0])
-            y = int(((y + 0.95) / 2) * img.shape[1])
-
-            return img[x, y]
-        except:
-            import ipdb
-
-            ipdb.set_trace()
+        return sample(img, x, y)
 
     FUNCTIONS[name] = image
-    register_function(name)(FUNCTIONS[name])
+    register_function(name, vectorized=True)(FUNCTIONS[name])
 
-@register_function("rotations_euler_gauss")
+
+@register_function("rotations_euler_gauss", vectorized=True)
 def rotations_euler_gauss(x, y):
     return Rotation.from_euler(
         "xyz",
-        [
-            0.5 * (1 - np.exp(-(x ** 2))),
-            0.5 * (1 - np.exp(-(y ** 2))),
-            0.2 * np.cos(2 * x * y),
-        ],
-    ).as_matrix()
-
-
-@register_function("rotations_euler")
+        np.stack(
+            [
+                0.5 * (1 - np.exp(-(x ** 2))),
+                0.5 * (1 - np.exp(-(y ** 2))),
+                0.2 * np.cos(2 * x * y),
+            ],
+            axis=-1,
+        ),
+    ).as_quat()
+
+
+@register_function("rotations_euler", vectorized=True)
 def rotations_euler(x, y):
     return Rotation.from_euler(
         "xyz",
-        [1.2 * np.sin(5 * x - 0.1), y ** 2 / 2 - np.sin(3 * x), 1.5 * np.cos(2 * x)],
-    ).as_matrix()
+        np.stack(
+            [
+                1.2 * np.sin(5 * x - 0.1),
+                y ** 2 / 2 - np.sin(3 * x),
+                1.5 * np.cos(2 * x),
+            ],
+            axis=-1,
+        ),
+    ).as_quat()
+
 
+@register_function("circle_angles", vectorized=True)
+def circle_angles(x, y):
+    return wrap_angles(np.sin(2 * x) + np.cos(3 * y) + 2)
 
-@register_function("spd")
+
+@register_function("circle", vectorized=True)
+def circle(x, y):
+    return vectors_from_angles(circle_angles(x, y))
+
+
+@register_function("spd", vectorized=True)
 def spd(x, y):
     # TODO: add check if function returns a valid manifold point.
-    z = (0.3 * np.abs(np.cos(2 * y)) + 0.6) * np.exp(-(x ** 2) - y ** 2) * (
-        5 * np.eye(3) + np.array([[np.sin(5 * y), y, x * y], [0, 0, y ** 2], [0, 0, 0]])
+    x, y = np.asarray(x), np.asarray(y)
+    zeros = np.zeros_like(x)
+    perturbation = np.stack(
+        [
+            np.stack([np.sin(5 * y), y, x * y], axis=-1),
+            np.stack([zeros, zeros, y ** 2], axis=-1),
+            np.stack([zeros, zeros, zeros], axis=-1),
+        ],
+        axis=-2,
+    )
+    scale = (0.3 * np.abs(np.cos(2 * y)) + 0.6) * np.exp(-(x ** 2) - y ** 2)
+    z = scale[..., np.newaxis, np.newaxis] * (
+        5 * np.eye(3) + perturbation
     ) + 0.3 * np.eye(3)
-    return z + np.transpose(z)
+    return z + np.swapaxes(z, -1, -2)
@@ -1,19 +1,39 @@
 """
 Different phi_{d,k} wendland functions.
 """
+from functools import wraps
+
+import numpy as np
+
 from Config.Options import options
 
 register_rbf = options.get_type_register("rbf")
 
+# The derivative d(phi)/dx of each rbf, under the same name
+register_rbf_derivative = options.get_type_register("rbf_derivative")
+
+# The rbf phi_{d,k} is positive definite on R^d (and below), so its kernel matrices
+# of distinct sites are positive definite in these dimensions only.
+POSITIVE_DEFINITE_DIMENSIONS = {
+    "wendland_1_0": 1,
+    "wendland_3_0": 3,
+    "wendland_3_1": 3,
+    "wendland_3_2": 3,
+}
+
 
 def safe_rbf(func):
+    """
+    Support the rbf in [0, 1], and evaluate it on scalars or arrays of distances.
+    """
+
+    @wraps(func)
     def _rbf(x):
-        if x < 0:
-            raise ValueError("x should be > 0, not {}".format(x))
-        if x > 1:
-            return 0
-        else:
-            return func(x)
+        x = np.asarray(x, dtype=np.float64)
+        if np.any(x < 0):
+            raise ValueError("x should be > 0, not {}".format(np.min(x)))
+        # Clip before the evaluation, the polynomials are not zero outside the support.
+        return np.where(x > 1, 0, func(np.minimum(x, 1)))[()]
 
     return _rbf
 
@@ -40,3 +60,27 @@ def wendland_3_0(x):
 @safe_rbf
 def wendland_3_1(x):
     return (1 + (4 * x)) * ((1 - x) ** 4)
+
+
+@register_rbf_derivative("wendland_1_0")
+@safe_rbf
+def wendland_1_0_derivative(x):
+    return -np.ones_like(x)
+
+
+@register_rbf_derivative("wendland_3_2")
+@safe_rbf
+def wendland_3_2_derivative(x):
+    return -56 * x * (5 * x + 1) * (1 - x) ** 5
+
+
+@register_rbf_derivative("wendland_3_0")
+@safe_rbf
+def wendland_3_0_derivative(x):
+    return -2 * (1 - x)
+
+
+@register_rbf_derivative("wendland_3_1")
+@safe_rbf
+def wendland_3_1_derivative(x):
+    return -20 * x * ((1 - x) ** 3)
@@ -0,0 +1,83 @@
+"""
+A persistent cache of arrays, addressed by the content they are calculated from.
+Every entry is a .npy file, loaded memory-mapped so readers touch only the slices they use.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+ENTRY_SUFFIX = ".npy"
+
+
+def content_key(*parts):
+    """ A key of arrays and parameters, the same content gives the same key """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(repr((part.dtype.str, part.shape)).encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(repr(part).encode())
+        # Separate the parts, so different splits of the same bytes differ
+        digest.update(b"|")
+
+    return digest.hexdigest()
+
+
+class ArrayCache(object):
+    def __init__(self, directory, max_size=None):
+        """
+        :param directory: The directory of the entries, created if missing.
+        :param max_size: Max total size of the entries in bytes.
+            The least recently used entries are evicted above it. None for no limit.
+        """
+        self._directory = directory
+        self._max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + ENTRY_SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __getitem__(self, key):
+        path = self._path(key)
+        value = np.load(path, mmap_mode="r")
+        # Mark the entry as recently used
+        os.utime(path)
+        return value
+
+    def __setitem__(self, key, value):
+        # Write to a temporary file first, so readers never see a partial entry.
+        temporary_path = os.path.join(
+            self._directory, f".{key}.{os.getpid()}{ENTRY_SUFFIX}"
+        )
+        np.save(temporary_path, np.asarray(value))
+        os.replace(temporary_path, self._path(key))
+
+        if self._max_size is not None:
+            self._evict()
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+
+        return self[key]
+
+    def _evict(self):
+        entries = [
+            os.path.join(self._directory, name)
+            for name in os.listdir(self._directory)
+            if name.endswith(ENTRY_SUFFIX) and not name.startswith(".")
+        ]
+        entries.sort(key=os.path.getmtime)
+        total_size = sum(os.path.getsize(path) for path in entries)
+
+        for path in entries:
+            if total_size <= self._max_size:
+                break
+            total_size -= os.path.getsize(path)
+            os.remove(path)
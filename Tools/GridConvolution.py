@@ -0,0 +1,147 @@
+"""
+Weighted sums of grid sites on a refinement of their grid, as a convolution.
+The sites are placed on the fine grid, so the sums of all the points are a single
+FFT convolution with the kernel sampled on the offsets of the fine grid.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.signal import fftconvolve
+
+# Tolerance of the grids detection, in fractions of the fine step.
+GRID_TOLERANCE = 10 ** -6
+
+# Kernel taps below this fraction of the largest one are dropped, so every sum
+# of weights is either zero or well above the round-off of the FFT.
+KERNEL_TOLERANCE = 10 ** -12
+
+# Points of a raveled meshgrid: origin and steps are (x, y), shape is (rows, columns).
+GridStructure = namedtuple("GridStructure", ["origin", "steps", "shape"])
+
+# The sites grid on the fine grid: the fine (row, column) of the first site, and the strides.
+Refinement = namedtuple("Refinement", ["start", "strides"])
+
+
+def get_grid_structure(points):
+    """
+    Detect points of a raveled meshgrid, x changing first, as get_grid generates.
+    :param points: Array of shape (N, 2).
+    :return: The GridStructure of the points, or None if they are not a grid.
+    """
+    points = np.reshape(points, (-1, 2))
+    if points.shape[0] < 4:
+        return None
+
+    # The first row ends where y changes
+    columns = int(np.argmax(points[:, 1] != points[0, 1]))
+    if columns < 2 or points.shape[0] % columns != 0:
+        return None
+    rows = points.shape[0] // columns
+    if rows < 2:
+        return None
+
+    origin = points[0]
+    steps = np.array(
+        [
+            (points[columns - 1, 0] - origin[0]) / (columns - 1),
+            (points[-1, 1] - origin[1]) / (rows - 1),
+        ]
+    )
+    if np.any(steps <= 0):
+        return None
+
+    x, y = np.meshgrid(np.arange(columns), np.arange(rows))
+    expected = origin + steps * np.column_stack([x.ravel(), y.ravel()])
+    if np.any(np.abs(points - expected) > GRID_TOLERANCE * steps):
+        return None
+
+    return GridStructure(origin, steps, (rows, columns))
+
+
+def get_refinement(coarse, fine):
+    """
+    Place a coarse grid on a fine grid, whose step divides the coarse step.
+    :param coarse: GridStructure of the sites.
+    :param fine: GridStructure of the points.
+    :return: The Refinement of the coarse grid, in (row, column) order, or None if
+        the coarse grid is not on the fine grid.
+    """
+    # (x, y) -> (row, column)
+    ratios = (coarse.steps / fine.steps)[::-1]
+    shifts = ((coarse.origin - fine.origin) / fine.steps)[::-1]
+    strides = np.round(ratios).astype(np.int64)
+    start = np.round(shifts).astype(np.int64)
+
+    # The worst distance of a site from its place on the fine grid
+    errors = np.abs(ratios - strides) * (np.array(coarse.shape) - 1) + np.abs(
+        shifts - start
+    )
+    if np.any(strides < 1) or np.any(errors > GRID_TOLERANCE):
+        return None
+
+    return Refinement(start, strides)
+
+
+def grid_convolution(values, refinement, fine, rbf, radius):
+    """
+    The kernel weighted sums of the sites values, and the sums of the weights,
+    at all the points of the fine grid.
+    :param values: The sites values on their grid, array of shape (rows, columns, ...).
+    :param refinement: The Refinement of the sites on the fine grid.
+    :param fine: GridStructure of the points.
+    :param rbf: The kernel of the distance in units of radius.
+    :param radius: The support radius of the kernel.
+    :return: The sums, array of shape (points rows, points columns, ...),
+        and the sums of the weights, array of shape (points rows, points columns).
+    """
+    x_step, y_step = fine.steps
+    radius_in_rows = int(np.floor(radius / y_step))
+    radius_in_columns = int(np.floor(radius / x_step))
+    row_offsets, column_offsets = np.meshgrid(
+        np.arange(-radius_in_rows, radius_in_rows + 1),
+        np.arange(-radius_in_columns, radius_in_columns + 1),
+        indexing="ij",
+    )
+    distances = np.hypot(row_offsets * y_step, column_offsets * x_step)
+    kernel = np.where(
+        distances < radius, rbf(np.minimum(distances / radius, 1)), 0
+    ).astype(np.float64)
+    kernel[kernel < KERNEL_TOLERANCE * np.max(kernel)] = 0
+
+    # The frame of the fine grid that contains the sites and the points
+    sites_end = refinement.start + refinement.strides * (np.array(values.shape[:2]) - 1)
+    frame_start = np.minimum(refinement.start, 0)
+    frame_shape = np.maximum(sites_end + 1, fine.shape) - frame_start
+
+    sites_rows, sites_columns = [
+        slice(start, end + 1, stride)
+        for start, end, stride in zip(
+            refinement.start - frame_start, sites_end - frame_start, refinement.strides
+        )
+    ]
+    points_rows, points_columns = [
+        slice(-start, -start + size) for start, size in zip(frame_start, fine.shape)
+    ]
+
+    placed_values = np.zeros(tuple(frame_shape) + values.shape[2:])
+    placed_values[sites_rows, sites_columns] = values
+    is_site = np.zeros(tuple(frame_shape))
+    is_site[sites_rows, sites_columns] = 1
+
+    # The kernel is symmetric, so the convolution is the sum around each point.
+    sums = fftconvolve(
+        placed_values,
+        kernel.reshape(kernel.shape + (1,) * (values.ndim - 2)),
+        mode="same",
+        axes=(0, 1),
+    )[points_rows, points_columns]
+    weights_sums = fftconvolve(is_site, kernel, mode="same")[
+        points_rows, points_columns
+    ]
+
+    # Sums without any site are only round-off
+    is_empty = weights_sums < np.min(kernel[kernel > 0]) / 2
+    weights_sums[is_empty] = 0
+    sums[is_empty] = 0
+
+    return sums, weights_sums
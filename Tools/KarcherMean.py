@@ -1,68 +1,115 @@
+import warnings
+
 import numpy as np
 from numpy import linalg as la
-from scipy.linalg import expm, logm, sqrtm
+
+from Tools.SymmetricMatrices import (
+    apply_on_eigenvalues,
+    congruence,
+    sqrt_and_inv_sqrt,
+    symmetric_expm,
+    symmetrize,
+)
 
 if __name__ == "__main__":
     from Manifolds.SymmetricPositiveDefinite import SymmetricPositiveDefinite
 
 AVERAGE_TOLERANCE = 0.001
+MAX_ITERATIONS = 12
+
+# Conditions closer to 1 use the limit of the step length term.
+CONDITION_TOLERANCE = 10 ** -8
 
 
-class KarcherMean(object):
+class BatchKarcherMean(object):
+    """
+    Weighted Karcher means of many averaging problems at once.
+    Every iteration updates only the problems that did not converge yet.
+    """
+
     def __init__(self, manifold, values_to_average, weights):
+        """
+        :param manifold: The SPD manifold.
+        :param values_to_average: Array of shape (N, k, n, n).
+        :param weights: Array of shape (N, k). Padding values should have zero weights.
+        """
         self._manifold = manifold
-        self._values_to_average = values_to_average
-        self._weights = weights
-        # Removed this line because it doesn't work with lambdas. Mathematically it should be fine,
-        # but should be validated.
-        # assert all(w_i >= 0 for w_i in weights), f"All weights should be non-negative, {weights}"
-        assert all(
-            manifold.is_in_manifold(a_i) for a_i in values_to_average
+        self._values_to_average = np.asarray(values_to_average)
+        self._weights = np.asarray(weights)
+        self.iterations = np.zeros(self._weights.shape[0], dtype=int)
+        # Removed the non-negative weights assertion because it doesn't work with lambdas.
+        # Mathematically it should be fine, but should be validated.
+        assert np.all(
+            manifold.batch_is_in_manifold(self._values_to_average)
         ), "Not all values_to_average in _manifold"
 
     def _get_start_point(self):
-        return sum(
-            w_i * a_i for a_i, w_i in zip(self._values_to_average, self._weights)
+        return np.sum(
+            self._weights[..., np.newaxis, np.newaxis] * self._values_to_average, axis=1
         )
 
-    def _get_step_length(self, x_l):
-        x_sqrt_inv = la.inv(sqrtm(x_l))
-        matrices_to_condition = (
-            np.matmul(np.matmul(x_sqrt_inv, a_i), x_sqrt_inv)
-            for a_i in self._values_to_average
+    @staticmethod
+    def _get_step_length(eigenvalues, weights):
+        """
+        :param eigenvalues: The eigenvalues of x^(-1/2) a_i x^(-1/2), shape (N, k, n).
+        :param weights: Array of shape (N, k).
+        """
+        conditions = np.max(eigenvalues, axis=-1) / np.min(eigenvalues, axis=-1)
+        is_conditioned = conditions - 1 > CONDITION_TOLERANCE
+        safe_conditions = np.where(is_conditioned, conditions, 2)
+        terms = np.where(
+            is_conditioned,
+            np.log(safe_conditions) * (safe_conditions + 1) / (safe_conditions - 1),
+            2,
         )
 
-        eigenvalues = (la.eig(m_i)[0] for m_i in matrices_to_condition)
-        conditions = (max(eig_i) / min(eig_i) for eig_i in eigenvalues)
+        return 2 / np.sum(weights * terms, axis=1)
+
+    def _step(self, base, values_to_average, weights):
+        sqrt_base, inv_sqrt_base = sqrt_and_inv_sqrt(base)
+        eigenvalues, eigenvectors = la.eigh(
+            symmetrize(congruence(inv_sqrt_base[:, np.newaxis], values_to_average))
+        )
 
-        return 2 / sum(
-            w_i * np.log(c_i) * ((c_i + 1) / (c_i - 1))
-            for c_i, w_i in zip(conditions, self._weights)
+        step_length = self._get_step_length(eigenvalues, weights)
+        logs = apply_on_eigenvalues(eigenvalues, eigenvectors, np.log)
+        exp_param = step_length[:, np.newaxis, np.newaxis] * np.sum(
+            weights[..., np.newaxis, np.newaxis] * logs, axis=1
         )
 
-    def get_average(self, base=None, i=0):
-        if base is None:
-            base = self._get_start_point()
+        return congruence(sqrt_base, symmetric_expm(exp_param))
 
-        step_length = self._get_step_length(base)
-        base_inv = la.inv(base)
+    def get_average(self):
+        """
+        :return: Array of shape (N, n, n) of the averages.
+        The number of iterations of each average is in self.iterations.
+        """
+        averages = self._get_start_point()
+        active = np.arange(averages.shape[0])
 
-        exp_param = step_length * sum(
-            w_i * logm(np.matmul(base_inv, a_i))
-            for a_i, w_i in zip(self._values_to_average, self._weights)
-        )
+        for iteration in range(1, MAX_ITERATIONS + 1):
+            base = averages[active]
+            x = self._step(base, self._values_to_average[active], self._weights[active])
+            averages[active] = x
+            self.iterations[active] = iteration
+
+            is_converged = self._manifold.batch_distance(x, base) < AVERAGE_TOLERANCE
+            active = active[~is_converged]
+            if active.shape[0] == 0:
+                return averages
 
-        x = np.matmul(base, expm(exp_param))
+        warnings.warn(f"{active.shape[0]} averages did not converge", RuntimeWarning)
+        return averages
 
-        distance = self._manifold.distance(x, base)
-        if distance < AVERAGE_TOLERANCE:
-            return x
 
-        if i > 10:
-            print("average did not converge")
-            return x
+class KarcherMean(BatchKarcherMean):
+    """ Weighted Karcher mean of a single averaging problem """
+
+    def __init__(self, manifold, values_to_average, weights):
+        super().__init__(manifold, np.array([values_to_average]), np.array([weights]))
 
-        return self.get_average(x, i + 1)
+    def get_average(self):
+        return super().get_average()[0]
 
 
 def main():
@@ -0,0 +1,146 @@
+"""
+An array of manifold elements, kept as a single contiguous float buffer.
+The buffer has the shape (*shape, *element_shape), the indexing acts on shape only.
+"""
+import numpy as np
+
+
+class ManifoldArray(object):
+    def __init__(self, data, element_shape=()):
+        """
+        :param data: Array of shape (*shape, *element_shape).
+        :param element_shape: The shape of a single element, e.g. (), (2,) or (3, 3).
+        """
+        self._element_shape = tuple(element_shape)
+        self._data = np.ascontiguousarray(data, dtype=np.float64)
+
+        if self._data.shape[self.ndim :] != self._element_shape:
+            raise ValueError(
+                f"Data of shape {self._data.shape} has no elements of shape {self._element_shape}"
+            )
+
+    @classmethod
+    def from_elements(cls, elements, shape=None):
+        """
+        Stack separate elements.
+        :param elements: A sequence (or an object array) of elements of the same shape.
+        :param shape: The shape of the result, the number of elements by default.
+        """
+        if isinstance(elements, np.ndarray) and elements.dtype == object:
+            elements = elements.ravel()
+        elements = list(elements)
+        data = np.array(elements, dtype=np.float64)
+        if shape is None:
+            shape = (len(elements),)
+
+        return cls(data.reshape(tuple(shape) + data.shape[1:]), data.shape[1:])
+
+    @classmethod
+    def load(cls, filename, element_shape=(), mmap_mode=None):
+        """ Load an array that was saved with save, memory-mapped with mmap_mode="r" """
+        return cls._from_buffer(np.load(filename, mmap_mode=mmap_mode), element_shape)
+
+    @classmethod
+    def _from_buffer(cls, data, element_shape):
+        """ Wrap data without a copy, memory-mapped data stays on disk """
+        array = cls.__new__(cls)
+        array._element_shape = tuple(element_shape)
+        array._data = data
+        return array
+
+    def save(self, filename):
+        np.save(filename, self._data)
+
+    @property
+    def data(self):
+        """ The buffer, of shape (*shape, *element_shape) """
+        return self._data
+
+    @property
+    def element_shape(self):
+        return self._element_shape
+
+    @property
+    def shape(self):
+        return self._data.shape[: self.ndim]
+
+    @property
+    def ndim(self):
+        return self._data.ndim - len(self._element_shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _batch_key(self, key):
+        """ Index the batch axes only, the element axes are taken whole """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(part is Ellipsis for part in key):
+            raise IndexError("Ellipsis is not supported, index the batch axes only")
+
+        return key + (slice(None),) * (self._data.ndim - len(key))
+
+    def __getitem__(self, key):
+        """ An element for an index of all the batch axes, otherwise a ManifoldArray """
+        data = self._data[self._batch_key(key)]
+        if data.ndim == len(self._element_shape):
+            # Scalar elements are numbers, not 0-d arrays
+            return data[()]
+
+        return ManifoldArray._from_buffer(data, self._element_shape)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, ManifoldArray):
+            value = value.data
+        self._data[self._batch_key(key)] = value
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self._data
+        return self._data.astype(dtype)
+
+    def __repr__(self):
+        return f"ManifoldArray(shape={self.shape}, element_shape={self._element_shape})"
+
+    def reshape(self, *shape):
+        if len(shape) == 1 and isinstance(shape[0], tuple):
+            shape = shape[0]
+
+        return ManifoldArray._from_buffer(
+            self._data.reshape(tuple(shape) + self._element_shape), self._element_shape
+        )
+
+    def ravel(self):
+        return self.reshape(-1)
+
+    def copy(self):
+        return ManifoldArray._from_buffer(self._data.copy(), self._element_shape)
+
+    @staticmethod
+    def concatenate(arrays):
+        """ Concatenate arrays of elements of the same shape along the first axis """
+        return ManifoldArray(
+            np.concatenate([array.data for array in arrays]), arrays[0].element_shape
+        )
+
+    def exp(self, manifold, tangents):
+        """ The batched exp of the manifold, from each element by its tangent """
+        return ManifoldArray(
+            manifold.batch_exp(self._data, np.asarray(tangents)), self._element_shape
+        )
+
+    def log(self, manifold, others):
+        """ The batched log of the manifold, the tangents from each element to the other """
+        return np.asarray(manifold.batch_log(self._data, np.asarray(others)))
+
+    def distance(self, manifold, others):
+        """ The batched distance of the manifold, array of the batch shape """
+        return np.asarray(manifold.batch_distance(self._data, np.asarray(others)))
@@ -0,0 +1,137 @@
+"""
+Closed form operations of SO(3), on unit quaternions and axis-angle vectors.
+Quaternions are in scalar-last order (x, y, z, w), like scipy's Rotation.
+All the functions work on stacks of shape (..., 4), (..., 3) or (..., 3, 3).
+"""
+import numpy as np
+from numpy import linalg as la
+from scipy.spatial.transform import Rotation
+
+# Below this angle the closed forms are replaced by their Taylor expansions.
+SMALL_ANGLE = 10 ** -6
+
+
+def hat(vectors):
+    """ The skew symmetric matrices of axis-angle vectors, (..., 3) -> (..., 3, 3) """
+    x, y, z = np.moveaxis(np.asarray(vectors), -1, 0)
+    zeros = np.zeros_like(x)
+    return np.stack(
+        [
+            np.stack([zeros, -z, y], axis=-1),
+            np.stack([z, zeros, -x], axis=-1),
+            np.stack([-y, x, zeros], axis=-1),
+        ],
+        axis=-2,
+    )
+
+
+def vee(matrices):
+    """ The axis-angle vectors of the skew symmetric part of matrices """
+    matrices = np.asarray(matrices)
+    return (
+        np.stack(
+            [
+                matrices[..., 2, 1] - matrices[..., 1, 2],
+                matrices[..., 0, 2] - matrices[..., 2, 0],
+                matrices[..., 1, 0] - matrices[..., 0, 1],
+            ],
+            axis=-1,
+        )
+        / 2
+    )
+
+
+def quaternions_from_matrices(matrices):
+    matrices = np.asarray(matrices)
+    quaternions = Rotation.from_matrix(matrices.reshape(-1, 3, 3)).as_quat()
+    return quaternions.reshape(matrices.shape[:-2] + (4,))
+
+
+def matrices_from_quaternions(quaternions):
+    quaternions = np.asarray(quaternions)
+    matrices = Rotation.from_quat(quaternions.reshape(-1, 4)).as_matrix()
+    return matrices.reshape(quaternions.shape[:-1] + (3, 3))
+
+
+def quaternion_conjugate(quaternions):
+    return quaternions * np.array([-1, -1, -1, 1])
+
+
+def quaternion_multiply(p, q):
+    """ The Hamilton product, the quaternion of the rotation R(p) R(q) """
+    x_1, y_1, z_1, w_1 = np.moveaxis(p, -1, 0)
+    x_2, y_2, z_2, w_2 = np.moveaxis(q, -1, 0)
+    return np.stack(
+        [
+            w_1 * x_2 + x_1 * w_2 + y_1 * z_2 - z_1 * y_2,
+            w_1 * y_2 - x_1 * z_2 + y_1 * w_2 + z_1 * x_2,
+            w_1 * z_2 + x_1 * y_2 - y_1 * x_2 + z_1 * w_2,
+            w_1 * w_2 - x_1 * x_2 - y_1 * y_2 - z_1 * z_2,
+        ],
+        axis=-1,
+    )
+
+
+def quaternion_log(quaternions):
+    """ The axis-angle vectors of unit quaternions, with angles in [0, pi] """
+    # q and -q are the same rotation, the positive scalar gives the shortest angle.
+    quaternions = quaternions * np.where(quaternions[..., 3:] < 0, -1, 1)
+    vectors, scalars = quaternions[..., :3], quaternions[..., 3]
+    sines = la.norm(vectors, axis=-1)
+    angles = 2 * np.arctan2(sines, scalars)
+
+    is_small = angles < SMALL_ANGLE
+    scales = np.where(is_small, 2 / scalars, angles / np.where(is_small, 1, sines))
+    return scales[..., np.newaxis] * vectors
+
+
+def quaternion_exp(vectors):
+    """ The unit quaternions of axis-angle vectors """
+    angles = la.norm(vectors, axis=-1)
+
+    is_small = angles < SMALL_ANGLE
+    scales = np.where(
+        is_small,
+        0.5 - angles ** 2 / 48,
+        np.sin(angles / 2) / np.where(is_small, 1, angles),
+    )
+    return np.concatenate(
+        [scales[..., np.newaxis] * vectors, np.cos(angles / 2)[..., np.newaxis]],
+        axis=-1,
+    )
+
+
+def rotation_log(matrices):
+    """ The axis-angle vectors of rotation matrices """
+    return quaternion_log(quaternions_from_matrices(matrices))
+
+
+def rotation_exp(vectors):
+    """ Rodrigues' formula, the rotation matrices of axis-angle vectors """
+    vectors = np.asarray(vectors)
+    angles = la.norm(vectors, axis=-1)[..., np.newaxis, np.newaxis]
+    skew = hat(vectors)
+
+    is_small = angles < SMALL_ANGLE
+    safe_angles = np.where(is_small, 1, angles)
+    sine_term = np.where(is_small, 1 - angles ** 2 / 6, np.sin(angles) / safe_angles)
+    cosine_term = np.where(
+        is_small, 0.5 - angles ** 2 / 24, (1 - np.cos(angles)) / safe_angles ** 2
+    )
+
+    return np.eye(3) + sine_term * skew + cosine_term * np.matmul(skew, skew)
+
+
+def quaternion_chordal_mean(quaternions, weights):
+    """
+    The weighted chordal L2 mean of unit quaternions: the dominant eigenvector of
+    the weighted sum of the outer products q q^T. It does not depend on the signs of q.
+    :param quaternions: Array of shape (..., k, 4).
+    :param weights: Array of shape (..., k).
+    :return: Array of shape (..., 4).
+    """
+    outer_products = np.einsum(
+        "...k,...ki,...kj->...ij", weights, quaternions, quaternions
+    )
+    # eigh sorts the eigenvalues in ascending order.
+    return la.eigh(outer_products)[1][..., -1]
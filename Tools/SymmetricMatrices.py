@@ -0,0 +1,55 @@
+"""
+Functions of symmetric matrices, using a single symmetric eigendecomposition.
+All the functions work on stacks of matrices of shape (..., n, n).
+"""
+import numpy as np
+from numpy import linalg as la
+
+
+def symmetrize(x):
+    """ Remove the numerical asymmetry of symmetric matrices """
+    return (x + np.swapaxes(x, -1, -2)) / 2
+
+
+def congruence(a, x):
+    """ a x a, for symmetric a """
+    return np.matmul(np.matmul(a, x), a)
+
+
+def apply_on_eigenvalues(eigenvalues, eigenvectors, func):
+    """
+    Calculate a matrix function from the eigendecomposition.
+    :param eigenvalues: Array of shape (..., n).
+    :param eigenvectors: Array of shape (..., n, n).
+    :param func: The scalar function, applied on arrays of eigenvalues.
+    :return: Array of shape (..., n, n).
+    """
+    return np.matmul(
+        eigenvectors * func(eigenvalues)[..., np.newaxis, :],
+        np.swapaxes(eigenvectors, -1, -2),
+    )
+
+
+def symmetric_function(x, func):
+    """ func(x) for symmetric matrices """
+    eigenvalues, eigenvectors = la.eigh(symmetrize(x))
+    return apply_on_eigenvalues(eigenvalues, eigenvectors, func)
+
+
+def sqrt_and_inv_sqrt(x):
+    """ x^(1/2) and x^(-1/2) of SPD matrices, from a single decomposition """
+    eigenvalues, eigenvectors = la.eigh(symmetrize(x))
+    sqrt_eigenvalues = np.sqrt(eigenvalues)
+    return (
+        apply_on_eigenvalues(sqrt_eigenvalues, eigenvectors, lambda w: w),
+        apply_on_eigenvalues(sqrt_eigenvalues, eigenvectors, lambda w: 1 / w),
+    )
+
+
+def symmetric_expm(x):
+    return symmetric_function(x, np.exp)
+
+
+def symmetric_logm(x):
+    """ The matrix log of SPD matrices """
+    return symmetric_function(x, np.log)
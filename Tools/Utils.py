@@ -5,6 +5,7 @@ from cachetools import cached, LFUCache
 
 from matplotlib import pyplot as plt
 
+import numpy as np
 from numpy import linalg as la
 
 num_of_caches_g = 0
@@ -25,6 +26,120 @@ def act_on_functions(action, a, b):
     return new_func
 
 
+def batched_function(approximate):
+    """
+    Wrap an evaluation on arrays of points as a function f(x, y).
+    The evaluation on arrays stays available as f.approximate(points).
+    """
+
+    def new_func(x, y):
+        return approximate(np.array([[x, y]]))[0]
+
+    new_func.approximate = approximate
+    return new_func
+
+
+def vectorized_function(func):
+    """
+    Mark a function f(x, y) that also evaluates arrays of coordinates,
+    f(x, y) of arrays of shape (N,) returns an array of shape (N, ...).
+    """
+    func.is_vectorized = True
+    return func
+
+
+def is_evaluated_on_arrays(func):
+    """ Can the function be evaluated on many points in a single call """
+    return hasattr(func, "approximate") or getattr(func, "is_vectorized", False)
+
+
+def evaluate_on_points(func, points):
+    """
+    Evaluate a function f(x, y) on many points.
+    Functions with f.approximate(points) and vectorized functions are evaluated in a single call.
+    :param points: Array of shape (N, 2).
+    :return: Array of shape (N, ...).
+    """
+    if hasattr(func, "approximate"):
+        return func.approximate(points)
+
+    if getattr(func, "is_vectorized", False):
+        points = np.reshape(points, (-1, 2))
+        return np.asarray(func(points[:, 0], points[:, 1]))
+
+    return np.array([func(x, y) for x, y in points])
+
+
+def segment_ids(offsets):
+    """ The segment index of each element, for segments given by offsets """
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def segment_positions(offsets, segments):
+    """
+    The positions of the elements of some of the segments.
+    :param offsets: The i-th segment is [offsets[i]:offsets[i + 1]].
+    :param segments: The indices of the selected segments.
+    :return: The offsets of the selected segments in the result, and the positions of their elements.
+    """
+    counts = np.diff(offsets)[segments]
+    selected_offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    np.cumsum(counts, out=selected_offsets[1:])
+    positions = np.arange(selected_offsets[-1]) + np.repeat(
+        offsets[segments] - selected_offsets[:-1], counts
+    )
+    return selected_offsets, positions
+
+
+def segment_sum(values, offsets):
+    """
+    Sum consecutive segments of values.
+    :param values: Array of shape (n, ...).
+    :param offsets: The i-th segment is values[offsets[i]:offsets[i + 1]].
+    :return: Array of shape (len(offsets) - 1, ...).
+    """
+    result = np.zeros((len(offsets) - 1,) + values.shape[1:], dtype=values.dtype)
+    np.add.at(result, segment_ids(offsets), values)
+    return result
+
+
+def apply_operator(operator, values):
+    """
+    Apply a linear operator on values of any shape.
+    :param operator: Sparse matrix of shape (N, n).
+    :param values: Array of shape (n, ...).
+    :return: Array of shape (N, ...).
+    """
+    values = np.asarray(values)
+    flat_values = values.reshape(values.shape[0], -1)
+    return np.asarray(operator @ flat_values).reshape(
+        (operator.shape[0],) + values.shape[1:]
+    )
+
+
+def pad_operator(operator, values, fill_value):
+    """
+    Arrange the rows of a sparse weights operator as dense arrays.
+    :param operator: CSR matrix of shape (N, n).
+    :param values: Array of shape (n, ...).
+    :param fill_value: The value of the padding, its weight is 0.
+    :return: The values of each row, shape (N, k, ...) and their weights, shape (N, k).
+    """
+    counts = np.diff(operator.indptr)
+    rows = segment_ids(operator.indptr)
+    columns = np.arange(len(rows)) - np.repeat(operator.indptr[:-1], counts)
+    shape = (operator.shape[0], max(np.max(counts, initial=0), 1))
+
+    padded_values = np.empty(shape + np.shape(values)[1:], dtype=np.result_type(values))
+    padded_values[...] = fill_value
+    padded_values[rows, columns] = values[operator.indices]
+
+    weights = np.zeros(shape, dtype=operator.dtype)
+    weights[rows, columns] = operator.data
+
+    return padded_values, weights
+
+
 def plot_and_save(data, title, filename):
     plt.figure()
     # plt.title(title)
@@ -60,8 +175,15 @@ def plot_lines(x_values, y_values, filename, title, x_label, y_label):
 
 
 def generate_kernel(rbf, scale=1):
+    """
+    :param rbf: The radial function, evaluated on arrays of distances.
+    :param scale: The support radius.
+    :return: kernel(x, y) of points of shape (..., 2), broadcasted to an array of shape (...).
+        For example kernel(points[:, np.newaxis], sites) is the (N, n) matrix of weights.
+    """
+
     def kernel(x, y):
-        ans = rbf(la.norm(x - y) / scale)
+        ans = rbf(la.norm(np.subtract(x, y), axis=-1) / scale)
         return ans
 
     return kernel
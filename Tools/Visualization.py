@@ -17,6 +17,7 @@ from pytransform3d.rotations import plot_basis
 if __name__ == "__main__":
     from Manifolds.SymmetricPositiveDefinite import SymmetricPositiveDefinite
     from Manifolds.RigidRotations import RigidRotations
+    from Tools.Rotations import matrices_from_quaternions
 
 
 VISUALIZATION_CONST = 10
@@ -25,15 +26,21 @@ MAX_AXIS_LEN = 15
 
 class Visualizer(object):
     def __init__(self, matrices, centers, dims=3):
+        """
+        :param matrices: Array of matrices of shape (..., dims, dims).
+        :param centers: Array of the centers of the matrices, shape (..., 3).
+        """
         self.fig = plt.figure(figsize=(12, 12))
         if dims == 3:
             self.ax = self.fig.add_subplot(projection="3d")
             self.ax.view_init(azim=0, elev=90)
         else:
             self.ax = self.fig.add_subplot()
-        indices = self._get_indices(matrices.shape)
+        matrices = np.asarray(matrices)
+        indices = self._get_indices(matrices.shape[:-2])
         self._matrices = matrices[indices]
-        self._centers = centers[indices]
+        self._centers = np.asarray(centers)[indices]
+        self._shape = self._matrices.shape[:-2]
 
     @staticmethod
     def _get_indices(shape):
@@ -53,7 +60,7 @@ class Visualizer(object):
         pass
 
     def save(self, filename, title):
-        for index in np.ndindex(self._matrices.shape):
+        for index in np.ndindex(self._shape):
             self._process_matrix(index)
         # Hide axes ticks
         self.ax.set_xticks([])
@@ -67,7 +74,7 @@ class Visualizer(object):
 
     def show(self):
         i = 1
-        for index in np.ndindex(self._matrices.shape):
+        for index in np.ndindex(self._shape):
             i += 1
             if i % VISUALIZATION_CONST == 0:
                 self._process_matrix(index)
@@ -87,24 +94,14 @@ class EllipsoidVisualizer(Visualizer):
         self._calculate_normalizer()
 
     def _calculate_normalizer(self):
-        max_radius = 0
-        for index in np.ndindex(self._singular_values.shape):
-            radii = self._singular_values[index]
-            if max(radii) > max_radius:
-                max_radius = max(radii)
+        max_radius = np.max(self._singular_values)
 
         print("Max Radius is ", max_radius)
 
         self._normalizer = max_radius
 
     def _svd_matrices(self):
-        singular_values = np.zeros_like(self._matrices, dtype=object)
-        rotations = np.zeros_like(self._matrices)
-        for index in np.ndindex(self._matrices.shape):
-            _, singular_values[index], rotations[index] = la.svd(self._matrices[index])
-
-        self._singular_values = singular_values
-        self._rotations = rotations
+        _, self._singular_values, self._rotations = la.svd(self._matrices)
 
     def _process_matrix(self, index):
         if not ((index[0] % 2 == 0) and (index[1] % 2 == 0)):
@@ -147,15 +144,11 @@ class RotationVisualizer(Visualizer):
 
     def save(self, filename, title):
         d_0 = np.array([1, 0, 0])
-        shape = list(self._matrices.shape)
         quiver_shape = 5
-        shape.append(quiver_shape)
-        parameters = np.zeros(shape)
-        for index in np.ndindex(self._matrices.shape):
-            parameters[index][:2] = self._centers[index][:2]
-            parameters[index][2:] = np.matmul(self._matrices[index], d_0)
-        # TODO: this line assumes shape of parameters (can't work with halton)
-        self.ax.quiver(*(parameters[:, :, i] for i in range(quiver_shape)))
+        parameters = np.zeros(self._shape + (quiver_shape,))
+        parameters[..., :2] = self._centers[..., :2]
+        parameters[..., 2:] = np.matmul(self._matrices, d_0)
+        self.ax.quiver(*(parameters[..., i] for i in range(quiver_shape)))
         # Hide axes ticks
         self.ax.set_xticks([])
         self.ax.set_yticks([])
@@ -169,9 +162,9 @@ class RotationVisualizer(Visualizer):
 def ellipsoids_main():
     print("start")
     spd = SymmetricPositiveDefinite()
-    matrices = np.zeros((3, 3), dtype=object)
-    centers = np.zeros_like(matrices)
-    for index in np.ndindex(matrices.shape):
+    matrices = np.zeros((3, 3, 3, 3))
+    centers = np.zeros((3, 3, 3))
+    for index in np.ndindex(matrices.shape[:2]):
         matrices[index] = spd.gen_point()
         centers[index] = np.array([index[0], index[1], 0])
     print("start to visualize")
@@ -181,11 +174,11 @@ def ellipsoids_main():
 def rotations_main():
     print("start")
     so_3 = RigidRotations()
-    matrices = np.zeros((3, 3), dtype=object)
-    centers = np.zeros_like(matrices)
-    for index in np.ndindex(matrices.shape):
+    matrices = np.zeros((3, 3, 3, 3))
+    centers = np.zeros((3, 3, 3))
+    for index in np.ndindex(matrices.shape[:2]):
         centers[index] = np.array([index[0], index[1], 0])
-        matrices[index] = so_3.gen_point()
+        matrices[index] = matrices_from_quaternions(so_3.gen_point())
 
     print("start to visualize")
     RotationVisualizer(matrices, centers).save("rotations.png", "rotations")